@@ -1,45 +1,134 @@
+from time import perf_counter
+STARTED_AT = perf_counter()
+
 from talelle_setup import Path, TALELLE_DIR, config_log
 TALELLE_TOOL = Path(__file__).stem
-config_log(TALELLE_TOOL)
 
 import sys
 import os
+import multiprocessing
 import json
 import datetime
+import functools
+import threading
+import instrumentation
 import placement
+from metadata_index import MetadataIndex
+from format_optimizer import place_images_on_best_format
+from page_budget import collect_and_fit_to_pages
+from page_formats import DEFAULT_FORMAT, parse_page_format, standard_formats
+from progress import STREAMING_PHASE_WEIGHTS, JobCancelled, ProgressReporter, ProgressStatus, format_duration
+from resampler import RenderOptions
 
 import logging
 from PySide6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel,
-                               QLineEdit, QFileDialog, QComboBox, QMessageBox, QProgressBar)
-from PySide6.QtCore import Qt, QThread, Signal
+                               QLineEdit, QFileDialog, QComboBox, QMessageBox, QProgressBar,
+                               QCheckBox, QSpinBox)
+from PySide6.QtCore import Qt, QThread, QTimer, Signal
 from PySide6.QtGui import QPixmap
 
 logger = logging.getLogger(__name__)
-logger.info(f'{TALELLE_TOOL} started')
 
 
 class PDFCreatorThread(QThread):
     creationStarted = Signal()
-    progressUpdated = Signal(int, str)
+    statusUpdated = Signal(str, int, float, float)
+    noImagesFound = Signal()
     creationFinished = Signal()
+    creationCancelled = Signal()
+    creationFailed = Signal(str)
+    sizeFitted = Signal(float, float)
 
-    def __init__(self, images, output_pdf_path, margin, min_size):
+    def __init__(self, directory, output_pdf_path, max_width_cm, max_height_cm, margin, scan_workers=None,
+                 render_options=None, engine=placement.ShelfEngine.name, incremental=False, copies=1,
+                 page_formats=(DEFAULT_FORMAT,), search_budget=0, fit_pages=0, max_open_pages=None):
         super().__init__()
-        self.images = images
+        self.directory = directory
         self.output_pdf_path = output_pdf_path
+        self.max_width_cm = max_width_cm
+        self.max_height_cm = max_height_cm
         self.margin = margin
-        self.min_size = min_size
+        self.scan_workers = scan_workers
+        self.render_options = render_options
+        self.engine = engine
+        self.incremental = incremental
+        self.copies = copies
+        self.page_formats = page_formats
+        self.search_budget = search_budget
+        self.fit_pages = fit_pages
+        self.max_open_pages = max_open_pages
+        self.profile = None
+        self.progress = None
 
     def run(self):
         self.creationStarted.emit()
-        placement.place_images_on_pdf(self.images, self.output_pdf_path, self.margin, self.min_size, self.updateProgress)
+        phases = ('scan', 'search', 'calculation', 'placement') if self.search_budget else \
+            ('scan', 'calculation', 'placement')
+        # The PDF is always streamed, so most pages are resampled and drawn during the calculation phase.
+        self.progress = ProgressReporter(None, self.updateStatus, phases,
+                                         cancelled=self.isInterruptionRequested, weights=STREAMING_PHASE_WEIGHTS)
+        try:
+            with instrumentation.profiling() as self.profile:
+                with MetadataIndex() as index:
+                    if self.fit_pages:
+                        page_format = self.page_formats[0]
+                        document = placement.VirtualDocument(self.margin, page_format.width, page_format.height)
+                        fit = collect_and_fit_to_pages(self.directory, self.max_width_cm, self.max_height_cm,
+                                                       self.fit_pages, document, self.progress, self.scan_workers,
+                                                       index, self.copies, self.engine, self.max_open_pages)
+                        images, min_size = fit.images, fit.min_size
+                        self.sizeFitted.emit(fit.max_width_cm, fit.max_height_cm)
+                    else:
+                        images, min_size = placement.collect_and_resize_images(self.directory, self.max_width_cm,
+                                                                               self.max_height_cm, self.progress,
+                                                                               self.scan_workers, index,
+                                                                               self.copies)
+                if images:
+                    for phase in ('calculation', 'placement'):
+                        self.progress.expect(phase, len(images))
+                    if len(self.page_formats) > 1:
+                        place_images_on_best_format(images, self.output_pdf_path, self.margin, min_size,
+                                                    list(self.page_formats), self.progress, self.render_options,
+                                                    True, self.engine, self.incremental,
+                                                    search_budget=self.search_budget,
+                                                    max_open_pages=self.max_open_pages)
+                    else:
+                        placement.place_images_on_pdf(images, self.output_pdf_path, self.margin, min_size,
+                                                      self.progress, self.render_options, streaming=True,
+                                                      engine=self.engine, incremental=self.incremental,
+                                                      page_format=self.page_formats[0],
+                                                      search_budget=self.search_budget,
+                                                      max_open_pages=self.max_open_pages)
+        except JobCancelled:
+            logger.info(f'Job cancelled after {self.profile.wall_seconds:.3f}s')
+            self.creationCancelled.emit()
+            return
+        except ValueError as e:
+            logger.warning(f'Job failed: {e}')
+            self.creationFailed.emit(str(e))
+            return
+        except Exception as e:
+            # Anything else, such as an unwritable output folder, must still give the buttons back.
+            logger.exception('Job failed')
+            self.creationFailed.emit(str(e) or type(e).__name__)
+            return
+        logger.info(f'Job profile:\n{self.profile.summary()}')
+        if not images:
+            self.noImagesFound.emit()
+            return
         self.creationFinished.emit()
 
-    def updateProgress(self, value, label=None):
-        self.progressUpdated.emit(value, label)
+    def updateStatus(self, status: ProgressStatus):
+        eta = -1 if status.eta is None else status.eta
+        rate = -1 if status.rate is None else status.rate
+        self.statusUpdated.emit(status.phase or '', status.overall, eta, rate)
 
 
 class ImageToPDFConverter(QWidget):
+    ENCODINGS = ('jpeg', 'lossless')
+    ENGINES = tuple(placement.ENGINES)
+    BEST_FORMAT = 'best_format'
+
     def __init__(self):
         super().__init__()
         settings = self.load_settings()
@@ -47,6 +136,12 @@ class ImageToPDFConverter(QWidget):
         self.translations = self.load_translations(self.current_language)
         self.project_path, self.project_folder = self.get_project_path(settings)
         self.images_folder = self.get_images_folder(settings)
+        self.scan_workers = self.get_scan_workers(settings)
+        self.jpeg_quality = self.get_jpeg_quality(settings)
+        self.variant_cache_mb = self.get_variant_cache_mb(settings)
+        self.render_shards = self.get_render_shards(settings)
+        self.max_open_pages = self.get_max_open_pages(settings)
+        self.candidate_formats = self.get_candidate_formats(settings)
 
         # declare QComponent groups
         self.locale_subjects = dict()
@@ -60,11 +155,22 @@ class ImageToPDFConverter(QWidget):
         self.maxWidthLineEdit = None
         self.maxHeightLineEdit = None
         self.marginLineEdit = None
+        self.dpiLineEdit = None
+        self.encodingComboBox = None
+        self.engineComboBox = None
+        self.incrementalCheckBox = None
+        self.copiesSpinBox = None
+        self.pageFormatComboBox = None
+        self.searchSpinBox = None
+        self.fitPagesSpinBox = None
         self.processButton = None
+        self.cancelButton = None
         self.progressLabel = None
         self.progressStatus = None
         self.progressBar = None
 
+        self.pdfThread = None
+
         self.setup_ui()
         self.apply_settings(settings)
         self.change_language(self.current_language)
@@ -74,7 +180,9 @@ class ImageToPDFConverter(QWidget):
     def get_settings_file():
         return os.path.join(TALELLE_DIR, f'{TALELLE_TOOL}.json')
 
-    def save_settings(self, language, maxWidth="", maxHeight="", margin=""):
+    def save_settings(self, language, maxWidth="", maxHeight="", margin="", dpi="", encoding="jpeg",
+                      engine=placement.ShelfEngine.name, incremental=False, copies=1,
+                      page_format=DEFAULT_FORMAT.name, search_seconds=0, fit_pages=0):
         settings = {
             'language': language,
             'projectPath': self.project_path,
@@ -82,7 +190,21 @@ class ImageToPDFConverter(QWidget):
             'imagesFolder': self.images_folder,
             'maxWidth': maxWidth,
             'maxHeight': maxHeight,
-            'margin': margin
+            'margin': margin,
+            'dpi': dpi,
+            'encoding': encoding,
+            'engine': engine,
+            'incremental': incremental,
+            'copies': copies,
+            'pageFormat': page_format,
+            'searchSeconds': search_seconds,
+            'fitPages': fit_pages,
+            'candidateFormats': self.candidate_formats,
+            'jpegQuality': self.jpeg_quality,
+            'variantCacheMB': self.variant_cache_mb,
+            'renderShards': self.render_shards,
+            'maxOpenPages': self.max_open_pages,
+            'scanWorkers': self.scan_workers
         }
         try:
             with open(self.get_settings_file(), 'w') as f:
@@ -113,6 +235,32 @@ class ImageToPDFConverter(QWidget):
     def get_images_folder(settings) -> str:
         return settings.get('imagesFolder', 'images')
 
+    @staticmethod
+    def get_scan_workers(settings) -> int | None:
+        scan_workers = settings.get('scanWorkers')
+        return int(scan_workers) if scan_workers else None
+
+    @staticmethod
+    def get_jpeg_quality(settings) -> int:
+        return int(settings.get('jpegQuality', 90))
+
+    @staticmethod
+    def get_variant_cache_mb(settings) -> int:
+        return int(settings.get('variantCacheMB', 2048))
+
+    @staticmethod
+    def get_render_shards(settings) -> int:
+        return int(settings.get('renderShards', 1))
+
+    @staticmethod
+    def get_max_open_pages(settings) -> int | None:
+        max_open_pages = settings.get('maxOpenPages')
+        return int(max_open_pages) if max_open_pages else None
+
+    @staticmethod
+    def get_candidate_formats(settings) -> list[str]:
+        return settings.get('candidateFormats') or [page_format.name for page_format in standard_formats()]
+
     @staticmethod
     def get_current_date():
         return datetime.datetime.now().strftime('%Y-%m-%d')
@@ -122,6 +270,14 @@ class ImageToPDFConverter(QWidget):
         self.maxWidthLineEdit.setText(settings.get('maxWidth', ''))
         self.maxHeightLineEdit.setText(settings.get('maxHeight', ''))
         self.marginLineEdit.setText(settings.get('margin', ''))
+        self.dpiLineEdit.setText(settings.get('dpi', ''))
+        self.encodingComboBox.setCurrentIndex(max(0, self.encodingComboBox.findData(settings.get('encoding', 'jpeg'))))
+        self.engineComboBox.setCurrentIndex(max(0, self.engineComboBox.findData(settings.get('engine'))))
+        self.incrementalCheckBox.setChecked(bool(settings.get('incremental', False)))
+        self.copiesSpinBox.setValue(int(settings.get('copies', 1)))
+        self.pageFormatComboBox.setCurrentIndex(max(0, self.pageFormatComboBox.findData(settings.get('pageFormat'))))
+        self.searchSpinBox.setValue(int(settings.get('searchSeconds', 0)))
+        self.fitPagesSpinBox.setValue(int(settings.get('fitPages', 0)))
 
         date_project_path = os.path.join(self.project_path, self.project_folder)
         self.projLineEdit.setText(date_project_path)
@@ -132,6 +288,7 @@ class ImageToPDFConverter(QWidget):
         return settings.get('language', 'English')
 
     @staticmethod
+    @functools.cache
     def load_language_codes():
         path = "locales/language_codes.json"
         with open(path, "r", encoding="utf-8") as f:
@@ -143,6 +300,7 @@ class ImageToPDFConverter(QWidget):
         return list(language_codes.keys())
 
     @classmethod
+    @functools.cache
     def load_translations(cls, language_name):
         language_codes = cls.load_language_codes()
         language_code = language_codes.get(language_name, "en")
@@ -227,10 +385,84 @@ class ImageToPDFConverter(QWidget):
         layout.addWidget(marginLabel)
         layout.addWidget(marginLineEdit)
 
+        # Print resolution and embedded image encoding
+        dpiLabel = QLabel()
+        dpiLineEdit = QLineEdit()
+        encodingLabel = QLabel()
+        encodingComboBox = QComboBox()
+        for encoding in self.ENCODINGS:
+            encodingComboBox.addItem(self.translate_key(encoding), encoding)
+        encodingLayout = QHBoxLayout()
+        encodingLayout.addWidget(encodingLabel)
+        encodingLayout.addWidget(encodingComboBox)
+        layout.addWidget(dpiLabel)
+        layout.addWidget(dpiLineEdit)
+        layout.addLayout(encodingLayout)
+
+        # Packing engine
+        engineLabel = QLabel()
+        engineComboBox = QComboBox()
+        for engine in self.ENGINES:
+            engineComboBox.addItem(self.translate_key(engine), engine)
+        engineLayout = QHBoxLayout()
+        engineLayout.addWidget(engineLabel)
+        engineLayout.addWidget(engineComboBox)
+        layout.addLayout(engineLayout)
+
+        # Page format, or the cheapest of the candidate formats
+        pageFormatLabel = QLabel()
+        pageFormatComboBox = QComboBox()
+        for page_format in standard_formats():
+            pageFormatComboBox.addItem(page_format.name, page_format.name)
+        pageFormatComboBox.addItem(self.translate_key(self.BEST_FORMAT), self.BEST_FORMAT)
+        pageFormatLayout = QHBoxLayout()
+        pageFormatLayout.addWidget(pageFormatLabel)
+        pageFormatLayout.addWidget(pageFormatComboBox)
+        layout.addLayout(pageFormatLayout)
+
+        # Page budget that sizes the images instead of the max width and height
+        fitPagesLabel = QLabel()
+        fitPagesSpinBox = QSpinBox()
+        fitPagesSpinBox.setRange(0, 9999)
+        fitPagesLayout = QHBoxLayout()
+        fitPagesLayout.addWidget(fitPagesLabel)
+        fitPagesLayout.addWidget(fitPagesSpinBox)
+        layout.addLayout(fitPagesLayout)
+
+        # Time spent looking for a layout with fewer pages
+        searchLabel = QLabel()
+        searchSpinBox = QSpinBox()
+        searchSpinBox.setRange(0, 600)
+        searchLayout = QHBoxLayout()
+        searchLayout.addWidget(searchLabel)
+        searchLayout.addWidget(searchSpinBox)
+        layout.addLayout(searchLayout)
+
+        # Copies per image
+        copiesLabel = QLabel()
+        copiesSpinBox = QSpinBox()
+        copiesSpinBox.setRange(1, 999)
+        copiesLayout = QHBoxLayout()
+        copiesLayout.addWidget(copiesLabel)
+        copiesLayout.addWidget(copiesSpinBox)
+        layout.addLayout(copiesLayout)
+
+        # Incremental layout
+        incrementalCheckBox = QCheckBox()
+        layout.addWidget(incrementalCheckBox)
+
         # Process button
         processButton = QPushButton(self.translate_key("Process Images"))
         processButton.clicked.connect(self.process_images)
-        layout.addWidget(processButton)
+        # Cancel button
+        cancelButton = QPushButton(self.translate_key("cancel"))
+        cancelButton.clicked.connect(self.cancel_processing)
+        cancelButton.setEnabled(False)
+
+        processLayout = QHBoxLayout()
+        processLayout.addWidget(processButton)
+        processLayout.addWidget(cancelButton)
+        layout.addLayout(processLayout)
 
         # Progress Bar
         progressLabel = QLabel("")
@@ -251,12 +483,28 @@ class ImageToPDFConverter(QWidget):
         self.locale_subjects['max_width'] = maxWidthLabel
         self.locale_subjects['max_height'] = maxHeightLabel
         self.locale_subjects['margin'] = marginLabel
+        self.locale_subjects['dpi'] = dpiLabel
+        self.locale_subjects['encoding'] = encodingLabel
+        self.locale_subjects['engine'] = engineLabel
+        self.locale_subjects['page_format'] = pageFormatLabel
+        self.locale_subjects['fit_pages'] = fitPagesLabel
+        self.locale_subjects['search_seconds'] = searchLabel
+        self.locale_subjects['copies'] = copiesLabel
+        self.locale_subjects['incremental'] = incrementalCheckBox
         self.locale_subjects['process_button'] = processButton
+        self.locale_subjects['cancel'] = cancelButton
 
         self.direction_subjects.append(langLayout)
         self.direction_subjects.append(projLayout)
         self.direction_subjects.append(dirLayout)
         self.direction_subjects.append(fileLayout)
+        self.direction_subjects.append(encodingLayout)
+        self.direction_subjects.append(engineLayout)
+        self.direction_subjects.append(pageFormatLayout)
+        self.direction_subjects.append(fitPagesLayout)
+        self.direction_subjects.append(searchLayout)
+        self.direction_subjects.append(copiesLayout)
+        self.direction_subjects.append(processLayout)
 
         self.langComboBox = langComboBox
         self.projLineEdit = projLineEdit
@@ -265,7 +513,16 @@ class ImageToPDFConverter(QWidget):
         self.maxWidthLineEdit = maxWidthLineEdit
         self.maxHeightLineEdit = maxHeightLineEdit
         self.marginLineEdit = marginLineEdit
+        self.dpiLineEdit = dpiLineEdit
+        self.encodingComboBox = encodingComboBox
+        self.engineComboBox = engineComboBox
+        self.incrementalCheckBox = incrementalCheckBox
+        self.copiesSpinBox = copiesSpinBox
+        self.pageFormatComboBox = pageFormatComboBox
+        self.searchSpinBox = searchSpinBox
+        self.fitPagesSpinBox = fitPagesSpinBox
         self.processButton = processButton
+        self.cancelButton = cancelButton
         self.progressLabel = progressLabel
         self.progressStatus = progressStatus
         self.progressBar = progressBar
@@ -284,6 +541,14 @@ class ImageToPDFConverter(QWidget):
         except ValueError:
             return False
 
+    # Resampling is off without a DPI, so a value like 0.3 must not quietly round down to it.
+    @staticmethod
+    def is_valid_dpi(value):
+        try:
+            return int(value) >= 1
+        except ValueError:
+            return False
+
     def choose_project(self):
         proj_path = QFileDialog.getExistingDirectory(self,
                                                     self.translate_key('choose_project'),
@@ -295,11 +560,7 @@ class ImageToPDFConverter(QWidget):
             images_path = os.path.join(proj_path, self.images_folder)
             self.dirLineEdit.setText(images_path)
 
-            proj_name = os.path.basename(proj_path)
-            proj_parent_name = os.path.basename(os.path.dirname(proj_path))
-
-
-            output_path = os.path.join(proj_path, f'{proj_parent_name}_{proj_name}.pdf')
+            output_path = placement.project_output_path(proj_path)
             self.fileLineEdit.setText(output_path)
 
         self.reset_progress()
@@ -335,6 +596,9 @@ class ImageToPDFConverter(QWidget):
 
         for locale_key in self.locale_subjects:
             self.locale_subjects[locale_key].setText(self.translate_key(locale_key))
+        for comboBox in (self.encodingComboBox, self.engineComboBox, self.pageFormatComboBox):
+            for index in range(comboBox.count()):
+                comboBox.setItemText(index, self.translate_key(comboBox.itemData(index)))
 
         # Update layout
         is_rtl = (language == 'עברית')
@@ -355,53 +619,130 @@ class ImageToPDFConverter(QWidget):
             QMessageBox.warning(self, self.translate_key("error_title"), self.translate_key("invalid_input"))
             return
 
+        if self.dpiLineEdit.text() and not self.is_valid_dpi(self.dpiLineEdit.text()):
+            QMessageBox.warning(self, self.translate_key("error_title"), self.translate_key("invalid_dpi"))
+            return
+
         directory = self.dirLineEdit.text()
         output_pdf_path = self.fileLineEdit.text()
         max_width_cm = float(self.maxWidthLineEdit.text())
         max_height_cm = float(self.maxHeightLineEdit.text())
         margin_cm = float(self.marginLineEdit.text())
         margin_points = placement.cm_to_points(margin_cm)
-        images, min_size = placement.collect_and_resize_images(directory, max_width_cm, max_height_cm)
+        dpi = int(self.dpiLineEdit.text()) if self.dpiLineEdit.text() else None
+        jpeg_quality = self.jpeg_quality if self.encodingComboBox.currentData() == 'jpeg' else None
+        render_options = RenderOptions(dpi, jpeg_quality, cache_budget=self.variant_cache_mb * 1024 * 1024,
+                                       shards=self.render_shards)
 
-        if not images:
-            QMessageBox.warning(self, self.translate_key("error_title"), self.translate_key("no_images_found"))
+        if self.fitPagesSpinBox.value() and self.pageFormatComboBox.currentData() == self.BEST_FORMAT:
+            QMessageBox.warning(self, self.translate_key("error_title"), self.translate_key("fit_pages_one_format"))
             return
+
         try:
-            self.pdfThread = PDFCreatorThread(images, output_pdf_path, margin_points, min_size)
+            page_format = self.pageFormatComboBox.currentData()
+            page_formats = [parse_page_format(spec) for spec in
+                            (self.candidate_formats if page_format == self.BEST_FORMAT else [page_format])]
+            self.pdfThread = PDFCreatorThread(directory, output_pdf_path, max_width_cm, max_height_cm,
+                                              margin_points, self.scan_workers, render_options,
+                                              self.engineComboBox.currentData(),
+                                              self.incrementalCheckBox.isChecked(), self.copiesSpinBox.value(),
+                                              page_formats, self.searchSpinBox.value(),
+                                              self.fitPagesSpinBox.value(), self.max_open_pages)
             self.pdfThread.creationStarted.connect(self.on_pdf_creation_started)
-            self.pdfThread.progressUpdated.connect(self.update_progress_bar)
+            self.pdfThread.statusUpdated.connect(self.update_progress_bar)
+            self.pdfThread.noImagesFound.connect(self.on_no_images_found)
             self.pdfThread.creationFinished.connect(self.on_pdf_creation_finished)
+            self.pdfThread.creationCancelled.connect(self.on_pdf_creation_cancelled)
+            self.pdfThread.creationFailed.connect(self.on_pdf_creation_failed)
+            self.pdfThread.sizeFitted.connect(self.on_size_fitted)
             self.pdfThread.start()
         except Exception as e:
             errorMessage = f"{self.translate_key('pdf_creation_failed')} {str(e)}"
             QMessageBox.warning(self, self.translate_key("error_title"), errorMessage)
 
 
+    def cancel_processing(self):
+        if self.pdfThread is not None and self.pdfThread.isRunning():
+            self.cancelButton.setEnabled(False)
+            self.pdfThread.requestInterruption()
+
+
     def on_pdf_creation_started(self):
         self.processButton.setEnabled(False)
+        self.cancelButton.setEnabled(True)
         self.save_settings(self.current_language,
-                            self.maxWidthLineEdit.text(), self.maxHeightLineEdit.text(), self.marginLineEdit.text())
+                            self.maxWidthLineEdit.text(), self.maxHeightLineEdit.text(), self.marginLineEdit.text(),
+                            self.dpiLineEdit.text(), self.encodingComboBox.currentData(),
+                            self.engineComboBox.currentData(), self.incrementalCheckBox.isChecked(),
+                            self.copiesSpinBox.value(), self.pageFormatComboBox.currentData(),
+                            self.searchSpinBox.value(), self.fitPagesSpinBox.value())
         self.progressLabel.setText(self.translate_key("started"))
 
 
-    def update_progress_bar(self, value, label):
-        if label:
-            self.progressLabel.setText(self.translate_key(label))
-        self.progressBar.setValue(value)
+    def update_progress_bar(self, phase, overall, eta, rate):
+        if phase:
+            self.progressStatus = phase
+        text = self.translate_key(self.progressStatus) if self.progressStatus else ''
+        if rate >= 0:
+            text += f' {rate:.0f} {self.translate_key("per_second")}'
+        if eta >= 0:
+            text += f' {self.translate_key("eta")} {format_duration(eta)}'
+        self.progressLabel.setText(text)
+        self.progressBar.setValue(overall)
+
+
+    def on_no_images_found(self):
+        QMessageBox.warning(self, self.translate_key("error_title"), self.translate_key("no_images_found"))
+        self.reset_progress()
+        self.processButton.setEnabled(True)
+        self.cancelButton.setEnabled(False)
 
 
     def on_pdf_creation_finished(self):
         QMessageBox.information(self, self.translate_key("success_title"), self.translate_key("success_message"),
                                 QMessageBox.StandardButton.Ok)
         self.progressLabel.setText(self.translate_key("finished"))
+        self.progressBar.setValue(100)
         self.processButton.setEnabled(True)
+        self.cancelButton.setEnabled(False)
+
+
+    def on_pdf_creation_failed(self, message):
+        QMessageBox.warning(self, self.translate_key("error_title"),
+                            f"{self.translate_key('pdf_creation_failed')} {message}")
+        self.reset_progress()
+        self.processButton.setEnabled(True)
+        self.cancelButton.setEnabled(False)
+
+
+    def on_size_fitted(self, max_width_cm, max_height_cm):
+        # Show the size that met the page budget, a later run with it needs no budget.
+        self.maxWidthLineEdit.setText(f'{max_width_cm:.2f}')
+        self.maxHeightLineEdit.setText(f'{max_height_cm:.2f}')
+
+
+    def on_pdf_creation_cancelled(self):
+        self.reset_progress()
+        self.progressLabel.setText(self.translate_key("cancelled"))
+        self.processButton.setEnabled(True)
+        self.cancelButton.setEnabled(False)
+
+
+def report_startup():
+    logger.info(f'Window shown {perf_counter() - STARTED_AT:.3f}s after start')
+    # Load the imaging and PDF libraries while the user fills in the form.
+    threading.Thread(target=placement.preload_backends, name='preload', daemon=True).start()
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     if hasattr(sys, '_MEIPASS'):
         os.chdir(sys._MEIPASS)
+    config_log(TALELLE_TOOL)
+    logger.info(f'{TALELLE_TOOL} started')
     app = QApplication(sys.argv)
     window = ImageToPDFConverter()
     window.show()
+    QTimer.singleShot(0, report_startup)
     sys.exit(app.exec())
 
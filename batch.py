@@ -0,0 +1,274 @@
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Optional
+
+import instrumentation
+import placement
+from format_optimizer import SCORES, describe, place_images_on_best_format
+from metadata_index import MetadataIndex
+from page_budget import collect_and_fit_to_pages
+from page_formats import DEFAULT_FORMAT, PageFormat, parse_page_format, standard_formats
+from progress import silent_progress
+from resampler import RenderOptions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MARGIN_CM = 0.2
+DEFAULT_JPEG_QUALITY = 90
+LOG_FORMAT = '%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+
+
+@dataclass(frozen=True)
+class BatchJob:
+    project: str
+    images_dir: str
+    output_pdf_path: str
+    max_width_cm: float
+    max_height_cm: float
+    margin_cm: float
+    render_options: RenderOptions
+    engine: str = placement.ShelfEngine.name
+    use_index: bool = True
+    incremental: bool = False
+    copies: int = 1
+    # More than one format packs all of them and renders the best one.
+    page_formats: tuple[PageFormat, ...] = (DEFAULT_FORMAT,)
+    score: str = 'area'
+    search_budget: float = 0
+    # A page budget makes the max width and height the largest box that keeps within it.
+    fit_pages: int = 0
+    # Pages still taking images beyond this many are closed, so a streamed PDF keeps memory bounded.
+    max_open_pages: Optional[int] = None
+    profile: bool = False
+
+
+@dataclass
+class JobResult:
+    project: str
+    output_pdf_path: str
+    status: str
+    seconds: float
+    images: int = 0
+    pages: int = 0
+    page_format: Optional[str] = None
+    error: Optional[str] = None
+    profile: Optional[str] = None
+    # The page formats compared for the project, best first.
+    formats: tuple[str, ...] = ()
+
+
+def config_worker_logging(level: int):
+    logging.basicConfig(level=level, format=LOG_FORMAT, stream=sys.stderr, force=True)
+
+
+def collect_images(job: BatchJob, index: Optional[MetadataIndex]) -> tuple[list[placement.VirtualImage], float]:
+    if job.fit_pages:
+        page_format = job.page_formats[0]
+        document = placement.VirtualDocument(placement.cm_to_points(job.margin_cm), page_format.width,
+                                             page_format.height)
+        fit = collect_and_fit_to_pages(job.images_dir, job.max_width_cm, job.max_height_cm, job.fit_pages, document,
+                                       silent_progress, index=index, copies=job.copies, engine=job.engine,
+                                       max_open_pages=job.max_open_pages)
+        return fit.images, fit.min_size
+    return placement.collect_and_resize_images(job.images_dir, job.max_width_cm, job.max_height_cm,
+                                               silent_progress, index=index, copies=job.copies)
+
+
+def run_job(job: BatchJob) -> JobResult:
+    if not job.profile:
+        return render_job(job)
+    with instrumentation.profiling() as profile:
+        result = render_job(job)
+    result.profile = profile.summary()
+    return result
+
+
+def render_job(job: BatchJob) -> JobResult:
+    start_time = perf_counter()
+    try:
+        if job.use_index:
+            with MetadataIndex() as index:
+                images, min_size = collect_images(job, index)
+        else:
+            images, min_size = collect_images(job, None)
+        if not images:
+            return JobResult(job.project, job.output_pdf_path, 'empty', perf_counter() - start_time)
+        margin = placement.cm_to_points(job.margin_cm)
+        page_format = job.page_formats[0]
+        formats = ()
+        if len(job.page_formats) > 1:
+            report, candidates = place_images_on_best_format(images, job.output_pdf_path, margin, min_size,
+                                                             list(job.page_formats), silent_progress,
+                                                             job.render_options, True, job.engine,
+                                                             job.incremental, job.score,
+                                                             job.render_options.workers, job.search_budget,
+                                                             job.max_open_pages)
+            page_format = candidates[0].page_format
+            formats = tuple(describe(candidate) for candidate in candidates)
+        else:
+            report = placement.place_images_on_pdf(images, job.output_pdf_path, margin, min_size, silent_progress,
+                                                   job.render_options, streaming=True, engine=job.engine,
+                                                   incremental=job.incremental, page_format=page_format,
+                                                   search_budget=job.search_budget,
+                                                   max_open_pages=job.max_open_pages)
+    except Exception as e:
+        logger.exception(f'Project {job.project} failed')
+        return JobResult(job.project, job.output_pdf_path, 'failed', perf_counter() - start_time,
+                         error=f'{type(e).__name__}: {e}')
+    return JobResult(job.project, job.output_pdf_path, 'ok', perf_counter() - start_time,
+                     report.image_count, report.page_count, page_format.name, formats=formats)
+
+
+def read_manifest(path: str) -> list[str]:
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [line.strip() for line in f]
+    base = os.path.dirname(os.path.abspath(path))
+    return [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+
+
+def make_jobs(projects: list[str], args: argparse.Namespace, render_options: RenderOptions) -> list[BatchJob]:
+    jobs = []
+    for project in dict.fromkeys(os.path.normpath(os.path.abspath(project)) for project in projects):
+        output_pdf_path = placement.project_output_path(project)
+        if args.output_dir:
+            output_pdf_path = os.path.join(args.output_dir, os.path.basename(output_pdf_path))
+        jobs.append(BatchJob(project, os.path.join(project, args.images_folder), output_pdf_path,
+                             args.max_width, args.max_height, args.margin, render_options, args.engine,
+                             not args.no_index, args.incremental, args.copies, args.page_formats, args.score,
+                             args.search_seconds, args.fit_pages, args.max_open_pages or None,
+                             args.profile))
+    return jobs
+
+
+def run_jobs(jobs: list[BatchJob], max_jobs: int, log_level: int) -> list[JobResult]:
+    results = []
+    width = max((len(job.project) for job in jobs), default=0)
+    with ProcessPoolExecutor(max_workers=max_jobs, initializer=config_worker_logging,
+                             initargs=(log_level,)) as executor:
+        futures = {executor.submit(run_job, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = JobResult(job.project, job.output_pdf_path, 'failed', 0, error=f'{type(e).__name__}: {e}')
+            results.append(result)
+            detail = result.error or (f'{result.images} images on {result.pages} {result.page_format} pages '
+                                      f'-> {result.output_pdf_path}' if result.status == 'ok' else 'no images found')
+            print(f'[{len(results)}/{len(jobs)}] {result.status:<6} {result.project:<{width}} '
+                  f'{result.seconds:8.1f}s  {detail}', flush=True)
+            for line in result.formats:
+                print(f'    {line}', flush=True)
+            if result.profile:
+                print(''.join(f'    {line}\n' for line in result.profile.splitlines()), end='', flush=True)
+    return results
+
+
+def print_summary(results: list[JobResult], wall_seconds: float):
+    by_status = {}
+    for result in results:
+        by_status.setdefault(result.status, []).append(result)
+    counts = ', '.join(f'{len(grouped)} {status}' for status, grouped in sorted(by_status.items()))
+    busy = sum(result.seconds for result in results)
+    print(f'{len(results)} projects in {wall_seconds:.1f}s ({busy:.1f}s of job time): {counts}')
+    for result in by_status.get('failed', []):
+        print(f'  failed: {result.project}: {result.error}')
+
+
+def page_format_arg(spec: str) -> PageFormat:
+    try:
+        return parse_page_format(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Render collage PDFs for many project folders without the GUI.')
+    parser.add_argument('projects', nargs='*', help='project directories, each with an images folder inside')
+    parser.add_argument('--manifest', action='append', default=[],
+                        help='text file with one project directory per line, relative to the file')
+    parser.add_argument('--images-folder', default='images', help='name of the images folder inside each project')
+    parser.add_argument('--max-width', type=float, required=True, help='max image width in cm')
+    parser.add_argument('--max-height', type=float, required=True, help='max image height in cm')
+    parser.add_argument('--margin', type=float, default=DEFAULT_MARGIN_CM, help='margin in cm')
+    parser.add_argument('--output-dir', help='write the PDFs here instead of into each project')
+    parser.add_argument('--engine', choices=sorted(placement.ENGINES), default=placement.ShelfEngine.name)
+    parser.add_argument('--dpi', type=int, help='resample to this print resolution')
+    parser.add_argument('--jpeg-quality', type=int, default=DEFAULT_JPEG_QUALITY,
+                        help='0 embeds resampled images losslessly')
+    parser.add_argument('--variant-cache-mb', type=int, default=0, help='resampled variant cache budget')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='projects rendered at the same time')
+    parser.add_argument('--no-index', action='store_true', help='do not use the image metadata index')
+    parser.add_argument('--incremental', action='store_true',
+                        help='keep the layout next to each PDF and only place images added since the last run')
+    parser.add_argument('--page-format', action='append', default=[], type=page_format_arg,
+                        help='A4, A3, A5, Letter or Legal with an optional -landscape, or WIDTHxHEIGHT in cm; '
+                             'append =COST for the sheet price. Give it several times to render the cheapest one')
+    parser.add_argument('--best-format', action='store_true',
+                        help='try all standard formats in portrait and landscape and render the cheapest one')
+    parser.add_argument('--score', choices=SCORES, default='area',
+                        help='what the cheapest format means: least paper area or lowest sheet cost')
+    parser.add_argument('--search-seconds', type=float, default=0,
+                        help='spend up to this long per project looking for a layout with fewer pages')
+    parser.add_argument('--fit-pages', type=int, default=0,
+                        help='grow or shrink the max width and height box to the largest size that fits on this '
+                             'many pages')
+    parser.add_argument('--copies', type=int, default=1,
+                        help='place every image this many times, its data is embedded once')
+    parser.add_argument('--max-open-pages', type=int, default=0,
+                        help='close the oldest pages when more than this many still take images, trading a few '
+                             'more pages for bounded memory')
+    parser.add_argument('--profile', action='store_true',
+                        help='print where the time of each project went: scanning, packing, resampling, writing')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    if not args.projects and not args.manifest:
+        parser.error('give at least one project directory or --manifest')
+    if args.copies < 1:
+        parser.error('--copies must be at least 1')
+    if args.best_format and len(args.page_format) == 1:
+        parser.error('--best-format compares several formats, give --page-format more than once or not at all')
+    args.page_formats = tuple(args.page_format) or (DEFAULT_FORMAT,)
+    if args.best_format and not args.page_format:
+        args.page_formats = tuple(standard_formats())
+    if args.max_open_pages < 0:
+        parser.error('--max-open-pages must not be negative')
+    if args.fit_pages < 0:
+        parser.error('--fit-pages must not be negative')
+    if args.fit_pages and len(args.page_formats) > 1:
+        parser.error('--fit-pages needs a single page format')
+    if args.score == 'cost' and any(page_format.sheet_cost is None for page_format in args.page_formats):
+        parser.error('--score cost needs a sheet cost for every --page-format, such as A4=0.05')
+    return args
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    log_level = logging.DEBUG if args.verbose else logging.WARNING
+    config_worker_logging(log_level)
+
+    projects = list(args.projects)
+    for manifest in args.manifest:
+        projects.extend(read_manifest(manifest))
+    max_jobs = max(1, min(args.jobs, len(projects)))
+    # Resampling workers are shared out between the projects that run at the same time.
+    render_options = RenderOptions(args.dpi, args.jpeg_quality or None,
+                                   workers=max(1, (os.cpu_count() or 1) // max_jobs),
+                                   cache_budget=args.variant_cache_mb * 1024 * 1024)
+    jobs = make_jobs(projects, args, render_options)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    start_time = perf_counter()
+    results = run_jobs(jobs, max_jobs, log_level)
+    print_summary(results, perf_counter() - start_time)
+    return 1 if any(result.status == 'failed' for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Optional
+
+from PIL import Image
+
+import instrumentation
+import placement
+from free_space import SortedSpaceList
+from image_table import ImageTable
+from progress import silent_progress
+from resampler import RenderOptions
+import scanner
+from scanner import ImageInfo
+
+logger = logging.getLogger(__name__)
+
+ASPECT_RATIOS = {
+    'photo': (4 / 3, 3 / 2, 16 / 9),
+    'square': (1.0,),
+    'mixed': (1.0, 5 / 4, 4 / 3, 3 / 2, 16 / 9, 2.0, 3.0),
+}
+MANIFEST_NAME = 'benchmark-manifest.json'
+
+
+def peak_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def git_version() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def generate_image_set(directory: str, count: int, seed: int = 0, min_side: int = 400, max_side: int = 4000,
+                       aspect: str = 'photo', png_share: float = 0.2) -> list[str]:
+    parameters = {'count': count, 'seed': seed, 'min_side': min_side, 'max_side': max_side,
+                  'aspect': aspect, 'png_share': png_share}
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest['parameters'] == parameters and all(os.path.exists(path) for path in manifest['files']):
+            return manifest['files']
+    except (FileNotFoundError, KeyError, json.JSONDecodeError):
+        pass
+
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    files = []
+    for number in range(count):
+        ratio = rng.choice(ASPECT_RATIOS[aspect])
+        long_side = rng.randint(min_side, max_side)
+        short_side = max(1, round(long_side / ratio))
+        size = (long_side, short_side) if rng.random() < 0.5 else (short_side, long_side)
+        noise = Image.effect_noise(size, rng.uniform(8, 64))
+        color = Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3)))
+        image = Image.blend(color, Image.merge('RGB', (noise, noise, noise)), 0.3)
+        subdirectory = os.path.join(directory, f'set{number % 10}')
+        os.makedirs(subdirectory, exist_ok=True)
+        if rng.random() < png_share:
+            path = os.path.join(subdirectory, f'image{number:06d}.png')
+            image.save(path, 'PNG')
+        else:
+            path = os.path.join(subdirectory, f'image{number:06d}.jpg')
+            image.save(path, 'JPEG', quality=90)
+        files.append(path)
+    with open(manifest_path, 'w') as f:
+        json.dump({'parameters': parameters, 'files': files}, f)
+    return files
+
+
+def run_benchmark(images_dir: str, output_pdf_path: str, max_width_cm: float, max_height_cm: float,
+                  margin_cm: float, engine: str, render_options: RenderOptions, max_workers: Optional[int]) -> dict:
+    results = {}
+
+    start_time = perf_counter()
+    images, min_size = placement.collect_and_resize_images(images_dir, max_width_cm, max_height_cm,
+                                                           silent_progress, max_workers)
+    results['scan'] = {'seconds': perf_counter() - start_time, 'images': len(images),
+                       'peak_rss_bytes': peak_rss_bytes()}
+
+    start_time = perf_counter()
+    document = placement.VirtualDocument(placement.cm_to_points(margin_cm))
+    packing_engine = placement.get_engine(engine)
+    virtual_canvas = packing_engine.pack(images, document, min_size, progress_callback=silent_progress)
+    results['pack'] = {'seconds': perf_counter() - start_time,
+                       'pages': sum(1 for page in virtual_canvas.canvas if page),
+                       'peak_rss_bytes': peak_rss_bytes()}
+
+    start_time = perf_counter()
+    virtual_canvas.makeItReal(output_pdf_path, render_options)
+    results['render'] = {'seconds': perf_counter() - start_time, 'pdf_bytes': os.path.getsize(output_pdf_path),
+                         'peak_rss_bytes': peak_rss_bytes()}
+    results['layout'] = packing_engine.report(virtual_canvas, document).to_dict()
+    return results
+
+
+def run_pack_scaling(counts: list[int], engine: str, seed: int = 0) -> list[dict]:
+    results = []
+    max_width_points, max_height_points = placement.max_box_points(2, 3)
+    for count in counts:
+        rng = random.Random(seed)
+        infos = [ImageInfo(f'image{number}', rng.randint(50, 400), rng.randint(50, 400), 'JPEG')
+                 for number in range(count)]
+        images, min_size = placement.fit_table(ImageTable(infos), max_width_points, max_height_points)
+        document = placement.VirtualDocument(placement.cm_to_points(0.2))
+        start_time = perf_counter()
+        packing_engine = placement.get_engine(engine)
+        virtual_canvas = packing_engine.pack(images, document, min_size, progress_callback=silent_progress)
+        seconds = perf_counter() - start_time
+        report = packing_engine.report(virtual_canvas, document)
+        results.append({'images': count, 'seconds': seconds, 'pages': report.page_count,
+                        'fill_ratio': report.fill_ratio})
+    return results
+
+
+class ListShelfEngine(placement.ShelfEngine):
+    space_index = SortedSpaceList
+
+
+def placements(virtual_canvas: placement.VirtualCanvas) -> list[tuple]:
+    return [(number, placed.x, placed.y, placed.image.width, placed.image.height, placed.image.rotated)
+            for number, page in enumerate(virtual_canvas.canvas) for placed in page]
+
+
+def run_free_space_check(sets: int, count: int, seed: int = 0) -> dict:
+    # Packs random image sets with FreeSpaceIndex and with the sorted list it replaced, the placements must match.
+    mismatches = []
+    for number in range(sets):
+        rng = random.Random(seed + number)
+        infos = [ImageInfo(f'image{index}', rng.randint(50, 4000), rng.randint(50, 4000), 'JPEG')
+                 for index in range(count)]
+        max_width_points, max_height_points = placement.max_box_points(rng.uniform(1, 10), rng.uniform(1, 15))
+        images, min_size = placement.fit_table(ImageTable(infos), max_width_points, max_height_points)
+        document = placement.VirtualDocument(placement.cm_to_points(rng.uniform(0, 1)))
+        indexed, listed = (placements(engine.pack(images, document, min_size, progress_callback=silent_progress))
+                           for engine in (placement.ShelfEngine(), ListShelfEngine()))
+        if indexed != listed:
+            mismatches.append(seed + number)
+    return {'sets': sets, 'images': count, 'mismatched_seeds': mismatches}
+
+
+def run_probe_comparison(images_dir: str) -> dict:
+    # Give it a folder on a network share or a slow disk to see what opening every file costs there.
+    paths = list(scanner.iter_image_files(images_dir))
+    results = {'images': len(paths)}
+    for name, probe in (('pillow', lambda path: scanner.checked_probe(path, scanner.probe_image)),
+                        ('native', scanner.checked_probe)):
+        start_time = perf_counter()
+        infos = [probe(path) for path in paths]
+        results[name] = {'seconds': perf_counter() - start_time,
+                         'images': sum(1 for info in infos if info is not None)}
+    return results
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark the scan, pack and render phases on synthetic images.')
+    parser.add_argument('--count', type=int, default=200, help='number of synthetic images')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-side', type=int, default=400, help='smallest long side in pixels')
+    parser.add_argument('--max-side', type=int, default=4000, help='largest long side in pixels')
+    parser.add_argument('--aspect', choices=sorted(ASPECT_RATIOS), default='photo')
+    parser.add_argument('--png-share', type=float, default=0.2, help='share of PNG files, the rest are JPEG')
+    parser.add_argument('--images-dir', help='where to keep the generated images (reused between runs)')
+    parser.add_argument('--max-width', type=float, default=6, help='max image width in cm')
+    parser.add_argument('--max-height', type=float, default=9, help='max image height in cm')
+    parser.add_argument('--margin', type=float, default=0.3, help='margin in cm')
+    parser.add_argument('--engine', choices=sorted(placement.ENGINES), default=placement.ShelfEngine.name)
+    parser.add_argument('--dpi', type=int, help='resample to this print resolution')
+    parser.add_argument('--jpeg-quality', type=int, default=90, help='0 embeds resampled images losslessly')
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--pack-scaling', help='comma separated image counts for a file-less packing run')
+    parser.add_argument('--probe', nargs='?', const='', metavar='DIR',
+                        help='time the native header probe against Pillow on DIR, or on the synthetic images')
+    parser.add_argument('--check-free-space', type=int, metavar='SETS',
+                        help='check that FreeSpaceIndex packs SETS random image sets like a sorted list, then exit')
+    parser.add_argument('--output', default='benchmark-results.json', help='JSON file the results are appended to')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None):
+    args = parse_args(argv)
+    if args.check_free_space:
+        check = run_free_space_check(args.check_free_space, args.count, args.seed)
+        print(json.dumps(check, indent=2))
+        if check['mismatched_seeds']:
+            sys.exit(1)
+        return
+    images_dir = args.images_dir or os.path.join(tempfile.gettempdir(), f'collage-benchmark-{args.seed}')
+    start_time = perf_counter()
+    generate_image_set(images_dir, args.count, args.seed, args.min_side, args.max_side, args.aspect, args.png_share)
+    generation_seconds = perf_counter() - start_time
+
+    render_options = RenderOptions(args.dpi, args.jpeg_quality or None, args.workers, shards=args.shards)
+    with tempfile.TemporaryDirectory(prefix='collage-benchmark-') as output_dir:
+        with instrumentation.profiling() as profile:
+            results = run_benchmark(images_dir, os.path.join(output_dir, 'benchmark.pdf'), args.max_width,
+                                    args.max_height, args.margin, args.engine, render_options, args.workers)
+
+    record = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'version': git_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'generation_seconds': generation_seconds,
+        'phases': results,
+        'profile': profile.to_dict(),
+    }
+    if args.probe is not None:
+        record['probe'] = run_probe_comparison(args.probe or images_dir)
+    if args.pack_scaling:
+        record['pack_scaling'] = run_pack_scaling([int(count) for count in args.pack_scaling.split(',')],
+                                                  args.engine, args.seed)
+
+    try:
+        with open(args.output, 'r') as f:
+            history = json.load(f)
+    except FileNotFoundError:
+        history = []
+    history.append(record)
+    with open(args.output, 'w') as f:
+        json.dump(history, f, indent=2)
+    print(json.dumps(record, indent=2))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,112 @@
+import logging
+import os
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from time import perf_counter
+from typing import Optional
+
+import placement
+from layout_report import LayoutReport
+from page_formats import POINTS_PER_CM, PageFormat
+from progress import silent_progress
+from resampler import RenderOptions
+
+logger = logging.getLogger(__name__)
+
+SCORES = ('area', 'cost')
+
+
+@dataclass
+class FormatCandidate:
+    page_format: PageFormat
+    pages: int = 0
+    paper_area_cm2: float = 0.0
+    cost: Optional[float] = None
+    fill_ratio: float = 0.0
+    seconds: float = 0.0
+    # Why the format was left out, None when it was packed.
+    skipped: Optional[str] = None
+
+    def score(self, by: str) -> float:
+        return self.cost if by == 'cost' else self.paper_area_cm2
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def largest_image(images: list[placement.VirtualImage]) -> tuple[float, float]:
+    return max(image.width for image in images), max(image.height for image in images)
+
+
+def pack_format(images: list[placement.VirtualImage], page_format: PageFormat, margin: float, min_size: float,
+                engine: str, max_open_pages: Optional[int] = None) -> FormatCandidate:
+    start_time = perf_counter()
+    candidate = FormatCandidate(page_format)
+    document = placement.VirtualDocument(margin, page_format.width, page_format.height)
+    width, height = largest_image(images)
+    if width > document.page_width - 2 * margin or height > document.page_height - 2 * margin:
+        candidate.skipped = 'the largest image does not fit on the page'
+        return candidate
+    packing_engine = placement.get_engine(engine, max_open_pages)
+    virtual_canvas = packing_engine.pack(images, document, min_size, progress_callback=silent_progress)
+    report = packing_engine.report(virtual_canvas, document)
+    candidate.pages = report.page_count
+    candidate.paper_area_cm2 = report.page_count * page_format.area / POINTS_PER_CM ** 2
+    if page_format.sheet_cost is not None:
+        candidate.cost = report.page_count * page_format.sheet_cost
+    candidate.fill_ratio = report.fill_ratio
+    candidate.seconds = perf_counter() - start_time
+    return candidate
+
+
+def search_formats(images: list[placement.VirtualImage], formats: list[PageFormat], margin: float,
+                   min_size: float, engine: str = placement.ShelfEngine.name, score: str = 'area',
+                   max_workers: Optional[int] = None,
+                   max_open_pages: Optional[int] = None) -> list[FormatCandidate]:
+    if score not in SCORES:
+        raise ValueError(f'Unknown score {score}, expected one of {", ".join(SCORES)}')
+    if score == 'cost' and any(page_format.sheet_cost is None for page_format in formats):
+        raise ValueError('Scoring by cost needs a sheet cost for every page format')
+    max_workers = max(1, min(len(formats), max_workers or os.cpu_count() or 1))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(pack_format, images, page_format, margin, min_size, engine, max_open_pages)
+                   for page_format in formats]
+        candidates = [future.result() for future in futures]
+    # The cheapest format wins, fewer sheets break ties and the given order breaks the rest.
+    return sorted(candidates, key=lambda candidate: (candidate.skipped is not None,
+                                                     candidate.score(score) if not candidate.skipped else 0,
+                                                     candidate.pages))
+
+
+def describe(candidate: FormatCandidate) -> str:
+    if candidate.skipped:
+        return f'{candidate.page_format.name}: skipped, {candidate.skipped}'
+    cost = f', cost {candidate.cost:.2f}' if candidate.cost is not None else ''
+    return (f'{candidate.page_format.name}: {candidate.pages} pages, {candidate.paper_area_cm2:.0f} cm2 of paper'
+            f'{cost}, {candidate.fill_ratio:.1%} filled, packed in {candidate.seconds:.3f}s')
+
+
+def place_images_on_best_format(images: list[placement.VirtualImage], output_pdf_path: str, margin: float,
+                                min_size: float, formats: list[PageFormat],
+                                progress_callback: Callable[[int, Optional[str]], None] = silent_progress,
+                                render_options: Optional[RenderOptions] = None,
+                                streaming: bool = False,
+                                engine: str = placement.ShelfEngine.name,
+                                incremental: bool = False,
+                                score: str = 'area',
+                                max_workers: Optional[int] = None,
+                                search_budget: float = 0,
+                                max_open_pages: Optional[int] = None
+                                ) -> tuple[LayoutReport, list[FormatCandidate]]:
+    progress_callback(0, 'calculation')
+    candidates = search_formats(images, formats, margin, min_size, engine, score, max_workers, max_open_pages)
+    best = candidates[0]
+    if best.skipped:
+        raise ValueError(f'The images do not fit on any of the page formats: {best.skipped}')
+    logger.info('Page formats considered, best first:\n' + '\n'.join(describe(candidate)
+                                                                      for candidate in candidates))
+    report = placement.place_images_on_pdf(images, output_pdf_path, margin, min_size, progress_callback,
+                                           render_options, streaming, engine, incremental, best.page_format,
+                                           search_budget, max_open_pages)
+    return report, candidates
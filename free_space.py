@@ -0,0 +1,174 @@
+import bisect
+from collections.abc import Callable, Iterator
+from typing import Optional, Protocol
+
+
+class Space(Protocol):
+    space: float
+    x: float
+
+
+def space_key(item: Space) -> float:
+    return item.space
+
+
+# Free spaces ordered by size in sorted buckets. The order matches a plain list kept with bisect.insort_right,
+# so lookups return the same space, but inserts and removals only shift one bucket and fit searches skip
+# whole buckets whose spaces all start too far to the right.
+class FreeSpaceIndex:
+    def __init__(self, load: int = 128):
+        self.load = load
+        self.buckets: list[list[Space]] = []
+        self.maxes: list[float] = []
+        self.min_x: list[float] = []
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[Space]:
+        for bucket in self.buckets:
+            yield from bucket
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def insert(self, item: Space):
+        if not self.buckets:
+            self.buckets.append([item])
+            self.maxes.append(item.space)
+            self.min_x.append(item.x)
+            self.length = 1
+            return
+        number = bisect.bisect_right(self.maxes, item.space)
+        if number == len(self.buckets):
+            number -= 1
+        bucket = self.buckets[number]
+        bisect.insort_right(bucket, item, key=space_key)
+        self.maxes[number] = bucket[-1].space
+        self.min_x[number] = min(self.min_x[number], item.x)
+        self.length += 1
+        if len(bucket) > 2 * self.load:
+            self.split(number)
+
+    def split(self, number: int):
+        bucket = self.buckets[number]
+        head, tail = bucket[:self.load], bucket[self.load:]
+        self.buckets[number:number + 1] = [head, tail]
+        self.maxes[number:number + 1] = [head[-1].space, tail[-1].space]
+        self.min_x[number:number + 1] = [min(item.x for item in head), min(item.x for item in tail)]
+
+    def locate(self, space: float) -> tuple[int, int]:
+        number = bisect.bisect_left(self.maxes, space)
+        if number == len(self.buckets):
+            return number, 0
+        return number, bisect.bisect_left(self.buckets[number], space, key=space_key)
+
+    def pop_at_least(self, space: float) -> Optional[Space]:
+        number, index = self.locate(space)
+        if number == len(self.buckets):
+            return None
+        return self.pop(number, index)
+
+    # The first space of at least `space` where `width` still ends by `right`, written as x + width <= right
+    # like the list code, since x <= right - width can round differently.
+    def find_fit(self, space: float, width: float, right: float) -> Optional[tuple[int, int]]:
+        number, index = self.locate(space)
+        while number < len(self.buckets):
+            if self.min_x[number] + width <= right:
+                bucket = self.buckets[number]
+                for position in range(index, len(bucket)):
+                    if bucket[position].x + width <= right:
+                        return number, position
+            number += 1
+            index = 0
+        return None
+
+    def get(self, number: int, index: int) -> Space:
+        return self.buckets[number][index]
+
+    def replace(self, number: int, index: int, item: Space):
+        bucket = self.buckets[number]
+        replaced = bucket[index]
+        bucket[index] = item
+        if item.x <= self.min_x[number]:
+            self.min_x[number] = item.x
+        elif replaced.x == self.min_x[number]:
+            self.min_x[number] = min(other.x for other in bucket)
+
+    def pop(self, number: int, index: int) -> Space:
+        bucket = self.buckets[number]
+        item = bucket.pop(index)
+        self.length -= 1
+        if bucket:
+            self.maxes[number] = bucket[-1].space
+            if item.x == self.min_x[number]:
+                self.min_x[number] = min(other.x for other in bucket)
+        else:
+            del self.buckets[number]
+            del self.maxes[number]
+            del self.min_x[number]
+        return item
+
+    def remove_if(self, predicate: Callable[[Space], bool]):
+        kept = [item for item in self if not predicate(item)]
+        self.buckets = [kept[start:start + self.load] for start in range(0, len(kept), self.load)]
+        self.maxes = [bucket[-1].space for bucket in self.buckets]
+        self.min_x = [min(item.x for item in bucket) for bucket in self.buckets]
+        self.length = len(kept)
+
+    def remove_below(self, space: float):
+        number, index = self.locate(space)
+        removed = sum(len(bucket) for bucket in self.buckets[:number]) + index
+        del self.buckets[:number]
+        del self.maxes[:number]
+        del self.min_x[:number]
+        if self.buckets and index:
+            bucket = self.buckets[0]
+            del bucket[:index]
+            self.min_x[0] = min(other.x for other in bucket)
+        self.length -= removed
+
+
+# The plain sorted list FreeSpaceIndex replaced, with the same interface. It is kept as the reference the index
+# is checked against, see benchmark.py --check-free-space.
+class SortedSpaceList:
+    def __init__(self):
+        self.items: list[Space] = []
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator[Space]:
+        return iter(self.items)
+
+    def __repr__(self) -> str:
+        return repr(self.items)
+
+    def insert(self, item: Space):
+        bisect.insort_right(self.items, item, key=space_key)
+
+    def pop_at_least(self, space: float) -> Optional[Space]:
+        index = bisect.bisect_left(self.items, space, key=space_key)
+        return self.items.pop(index) if index < len(self.items) else None
+
+    def find_fit(self, space: float, width: float, right: float) -> Optional[tuple[int, int]]:
+        for index in range(bisect.bisect_left(self.items, space, key=space_key), len(self.items)):
+            if self.items[index].x + width <= right:
+                return 0, index
+        return None
+
+    def get(self, number: int, index: int) -> Space:
+        return self.items[index]
+
+    def replace(self, number: int, index: int, item: Space):
+        self.items[index] = item
+
+    def pop(self, number: int, index: int) -> Space:
+        return self.items.pop(index)
+
+    def remove_if(self, predicate: Callable[[Space], bool]):
+        self.items = [item for item in self.items if not predicate(item)]
+
+    def remove_below(self, space: float):
+        del self.items[:bisect.bisect_left(self.items, space, key=space_key)]
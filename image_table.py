@@ -0,0 +1,51 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+import instrumentation
+from scanner import ImageInfo
+
+
+@dataclass
+class FittedImages:
+    order: np.ndarray
+    width: np.ndarray
+    height: np.ndarray
+    rotated: np.ndarray
+    min_size: float
+
+
+class ImageTable:
+    def __init__(self, infos: list[ImageInfo], duplicates: Optional[dict[str, str]] = None):
+        self.infos = infos
+        self.paths = [info.path for info in infos]
+        # The file each image is embedded from, shared by all images with the same content.
+        self.sources = [duplicates.get(path, path) for path in self.paths] if duplicates else self.paths
+        self.orientations = [info.orientation for info in infos]
+        sizes = [info.upright_size for info in infos]
+        self.raw_width = np.fromiter((width for width, _ in sizes), dtype=np.float64, count=len(infos))
+        self.raw_height = np.fromiter((height for _, height in sizes), dtype=np.float64, count=len(infos))
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def fit(self, max_width_points: float, max_height_points: float) -> FittedImages:
+        rotated = self.raw_height < self.raw_width
+        width = np.where(rotated, self.raw_height, self.raw_width)
+        height = np.where(rotated, self.raw_width, self.raw_height)
+
+        img_ratio = width / height
+        wide = img_ratio > max_width_points / max_height_points
+        new_width = np.minimum(max_width_points, width)
+        new_height = np.minimum(max_height_points, height)
+        new_width = np.where(wide, new_width, np.trunc(new_height * img_ratio))
+        new_height = np.where(wide, np.trunc(new_width / img_ratio), new_height)
+
+        # Tallest first, then widest, keeping scan order between equal sizes like a stable reverse sort.
+        with instrumentation.span('sort'):
+            order = np.lexsort((-new_width, -new_height))
+        min_size = min(max_width_points, max_height_points)
+        if len(self):
+            min_size = min(min_size, float(new_width.min()), float(new_height.min()))
+        return FittedImages(order, new_width, new_height, rotated, min_size)
@@ -0,0 +1,104 @@
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from typing import Optional
+
+
+class SpanStats:
+    __slots__ = ('calls', 'seconds', 'longest')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.longest = 0.0
+
+
+class Profile:
+    def __init__(self):
+        self.spans: dict[str, SpanStats] = {}
+        self.counters: dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.started = perf_counter()
+        self.wall_seconds = 0.0
+
+    def add_span(self, name: str, seconds: float):
+        with self.lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            if seconds > stats.longest:
+                stats.longest = seconds
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def finish(self):
+        self.wall_seconds = perf_counter() - self.started
+
+    def to_dict(self) -> dict:
+        return {
+            'wall_seconds': self.wall_seconds,
+            'spans': {name: {'calls': stats.calls, 'seconds': stats.seconds, 'longest': stats.longest}
+                      for name, stats in self.spans.items()},
+            'counters': dict(self.counters),
+        }
+
+    def summary(self) -> str:
+        lines = [f'job took {self.wall_seconds:.3f}s']
+        for name, stats in sorted(self.spans.items(), key=lambda item: item[1].seconds, reverse=True):
+            lines.append(f'{name:>12} {stats.seconds:10.3f}s {stats.calls:8} calls, longest {stats.longest:.3f}s')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'{name:>24} {value}')
+        return '\n'.join(lines)
+
+
+class Span:
+    __slots__ = ('profile', 'name', 'started')
+
+    def __init__(self, profile: Profile, name: str):
+        self.profile = profile
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profile.add_span(self.name, perf_counter() - self.started)
+
+
+# Spans and counters go to the profile of the running job. Without one they cost a global lookup.
+_active: Optional[Profile] = None
+_disabled = nullcontext()
+
+
+def span(name: str):
+    profile = _active
+    if profile is None:
+        return _disabled
+    return Span(profile, name)
+
+
+def count(name: str, amount: int = 1):
+    profile = _active
+    if profile is not None:
+        profile.count(name, amount)
+
+
+@contextmanager
+def profiling(profile: Optional[Profile] = None) -> Iterator[Profile]:
+    global _active
+    if profile is None:
+        profile = Profile()
+    previous = _active
+    _active = profile
+    try:
+        yield profile
+    finally:
+        profile.finish()
+        _active = previous
@@ -0,0 +1,81 @@
+import logging
+import mmap
+from typing import Optional, TYPE_CHECKING
+
+from reportlab.lib.utils import _digester
+from reportlab.pdfbase.pdfdoc import PDFImageXObject
+
+import instrumentation
+from scanner import JpegFrame, parse_jpeg
+
+if TYPE_CHECKING:
+    from reportlab.pdfgen.canvas import Canvas
+
+logger = logging.getLogger(__name__)
+
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+# Baseline, extended and progressive frames, the ones every PDF viewer's DCTDecode filter reads.
+PASSTHROUGH_MARKERS = frozenset({0xC0, 0xC1, 0xC2})
+COLOR_SPACES = {1: 'DeviceGray', 3: 'DeviceRGB', 4: 'DeviceCMYK'}
+
+
+# An image XObject whose stream is the JPEG file itself. Only the frame header is read when the image is drawn,
+# the file is mapped and copied into the PDF when the document is saved, without decoding or ASCII85 encoding it.
+class JpegImageXObject(PDFImageXObject):
+    def __init__(self, name: str, path: str, frame: JpegFrame):
+        super().__init__(name)
+        self.path = path
+        self.width = frame.width
+        self.height = frame.height
+        self.bitsPerComponent = 8
+        self.colorSpace = COLOR_SPACES[frame.components]
+        # Like reportlab, take a four component JPEG for an inverted Adobe CMYK one.
+        self._dotrans = frame.components == 4
+        self._filters = ('DCTDecode',)
+        self.streamContent = None
+
+    def format(self, document) -> bytes:
+        with instrumentation.span('passthrough'):
+            with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                self.streamContent = data[:]
+            try:
+                return super().format(document)
+            finally:
+                self.streamContent = None
+
+
+def read_frame(path: str) -> Optional[JpegFrame]:
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(JPEG_SIGNATURE)) != JPEG_SIGNATURE:
+                return None
+            frame = parse_jpeg(f)
+    except OSError:
+        return None
+    if frame is None or frame.marker not in PASSTHROUGH_MARKERS or frame.precision != 8 \
+            or frame.components not in COLOR_SPACES:
+        return None
+    return frame
+
+
+def register(real: 'Canvas', path: str):
+    # Registers a JPEG under the name reportlab gives a file drawn without a mask, so drawImage finds it embedded
+    # already and only places it. Anything else is left for reportlab to load the first time it is drawn.
+    name = _digester(f'{path}None'.encode('utf-8'))
+    reg_name = real._doc.getXObjectName(name)
+    if reg_name in real._doc.idToObject:
+        return
+    frame = read_frame(path)
+    if frame is None:
+        return
+    image = JpegImageXObject(name, path, frame)
+    real._setXObjects(image)
+    real._doc.Reference(image, reg_name)
+    real._doc.addForm(name, image)
+    instrumentation.count('jpeg_passthrough')
+    logger.debug('Passing %s through as a %dx%d JPEG stream', path, frame.width, frame.height)
+
+
+def draw_image(real: 'Canvas', path: str, x: float, y: float, width: float, height: float):
+    register(real, path)
+    real.drawImage(path, x, y, width=width, height=height)
@@ -0,0 +1,63 @@
+import json
+from dataclasses import asdict, dataclass, field
+
+from page_formats import POINTS_PER_CM
+
+
+def square_cm(area_points: float) -> float:
+    return area_points / POINTS_PER_CM ** 2
+
+
+@dataclass
+class PageReport:
+    page: int
+    images: int
+    used_area_cm2: float
+    fill_ratio: float
+
+
+@dataclass
+class LayoutReport:
+    engine: str
+    page_count: int
+    image_count: int
+    page_area_cm2: float
+    used_area_cm2: float
+    wasted_area_cm2: float
+    fill_ratio: float
+    gap_placements: int
+    row_placements: int
+    free_spaces: int
+    free_area_cm2: float
+    largest_free_space_cm2: float
+    fragmentation: float
+    pages: list[PageReport] = field(default_factory=list)
+
+    @classmethod
+    def build(cls, engine: str, page_width: float, page_height: float, page_used_areas: list[float],
+              page_images: list[int], gap_placements: int, row_placements: int,
+              free_space_areas: list[float], free_area: float) -> 'LayoutReport':
+        page_area = page_width * page_height
+        pages = [PageReport(number, images, square_cm(used_area), used_area / page_area)
+                 for number, (used_area, images) in enumerate(zip(page_used_areas, page_images))]
+        total_area = page_area * len(pages)
+        used_area = sum(page_used_areas)
+        largest_free_area = max(free_space_areas, default=0)
+        # 0 when the leftover free space is one block, approaching 1 as it is scattered into many small ones.
+        fragmentation = 1 - largest_free_area / free_area if free_area else 0
+        return cls(engine, len(pages), sum(page_images), square_cm(page_area), square_cm(used_area),
+                   square_cm(total_area - used_area), used_area / total_area if total_area else 0,
+                   gap_placements, row_placements, len(free_space_areas), square_cm(free_area),
+                   square_cm(largest_free_area),
+                   fragmentation, pages)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def to_json(self, indent: int = None) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def summary(self) -> str:
+        return (f'{self.page_count} pages, {self.image_count} images, fill {self.fill_ratio:.1%}, '
+                f'wasted {self.wasted_area_cm2:.0f} cm2, {self.gap_placements} in gaps / '
+                f'{self.row_placements} in rows, fragmentation {self.fragmentation:.2f}')
@@ -0,0 +1,171 @@
+import logging
+import math
+import multiprocessing
+import os
+import random
+from collections.abc import Callable
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from time import time
+from typing import Optional
+
+import placement
+from placement import VirtualDocument, VirtualImage
+from progress import silent_progress
+
+logger = logging.getLogger(__name__)
+
+RESTART_AFTER = 200
+START_TEMPERATURE = 0.05
+POLL_INTERVAL = 0.1
+
+# Alternative orders the search restarts from, besides the packer's own tallest-first order.
+RESTART_ORDERS = (
+    lambda image: (image.height, image.width),
+    lambda image: (image.width * image.height, image.height),
+    lambda image: (max(image.width, image.height), min(image.width, image.height)),
+    lambda image: (image.width, image.height),
+)
+
+# An arrangement is the order images are packed in, with a flag for the ones packed turned by 90 degrees.
+Arrangement = list[tuple[int, bool]]
+
+
+@dataclass
+class SearchResult:
+    cost: float
+    arrangement: Arrangement
+    evaluated: int
+
+
+def layout_cost(virtual_canvas: placement.VirtualCanvas, page_area: float) -> float:
+    # Fewer pages first, then the emptiest last page, which means the fullest pages before it.
+    # The used area of a page never exceeds the page, so one number orders both.
+    pages = len(virtual_canvas.canvas)
+    if pages > 1 and not virtual_canvas.canvas[-1]:
+        pages -= 1
+    return (pages - 1) * page_area + virtual_canvas.page_used_areas[pages - 1]
+
+
+def pages_and_last_fill(cost: float, page_area: float) -> tuple[int, float]:
+    pages = max(1, math.ceil(cost / page_area))
+    return pages, (cost - (pages - 1) * page_area) / page_area
+
+
+def arrange(images: list[VirtualImage], arrangement: Arrangement) -> list[VirtualImage]:
+    return [placement.rotate(images[index]) if turned else images[index] for index, turned in arrangement]
+
+
+def evaluate(images: list[VirtualImage], arrangement: Arrangement, document: VirtualDocument, min_size: float,
+             engine: str, max_open_pages: Optional[int] = None) -> float:
+    packing_engine = placement.get_engine(engine, max_open_pages)
+    virtual_canvas = packing_engine.pack(arrange(images, arrangement), document, min_size,
+                                         progress_callback=silent_progress)
+    return layout_cost(virtual_canvas, document.page_width * document.page_height)
+
+
+def turnable(images: list[VirtualImage], document: VirtualDocument) -> list[int]:
+    inner_width = document.page_width - 2 * document.margin
+    inner_height = document.page_height - 2 * document.margin
+    return [index for index, image in enumerate(images)
+            if image.width != image.height and image.height <= inner_width and image.width <= inner_height]
+
+
+def restart(images: list[VirtualImage], rng: random.Random) -> Arrangement:
+    key = rng.choice(RESTART_ORDERS)
+    # Random tie-breaks between images of the same size.
+    order = sorted(range(len(images)), key=lambda index: (key(images[index]), rng.random()), reverse=True)
+    return [(index, False) for index in order]
+
+
+def mutate(arrangement: Arrangement, turnable_indexes: list[int], rng: random.Random) -> Arrangement:
+    arrangement = list(arrangement)
+    size = len(arrangement)
+    move = rng.randrange(3 if turnable_indexes else 2)
+    if move == 0:
+        first, second = rng.randrange(size), rng.randrange(size)
+        arrangement[first], arrangement[second] = arrangement[second], arrangement[first]
+    elif move == 1:
+        arrangement.insert(rng.randrange(size), arrangement.pop(rng.randrange(size)))
+    else:
+        flip = rng.choice(turnable_indexes)
+        position = next(position for position, (index, _) in enumerate(arrangement) if index == flip)
+        arrangement[position] = (flip, not arrangement[position][1])
+    return arrangement
+
+
+def search_worker(images: list[VirtualImage], document: VirtualDocument, min_size: float, engine: str,
+                  deadline: float, seed: int, restarted: bool = False, stop=None,
+                  max_open_pages: Optional[int] = None) -> SearchResult:
+    # Simulated annealing from the packer's own order, restarting from a reordered one when it stalls.
+    rng = random.Random(seed)
+    page_area = document.page_width * document.page_height
+    turnable_indexes = turnable(images, document)
+    current: Arrangement = [(index, False) for index in range(len(images))]
+    if restarted:
+        current = restart(images, rng)
+    current_cost = evaluate(images, current, document, min_size, engine, max_open_pages)
+    best = SearchResult(current_cost, current, 1)
+    started = time()
+    stalled = 0
+    while time() < deadline and (stop is None or not stop.is_set()):
+        candidate = mutate(current, turnable_indexes, rng)
+        cost = evaluate(images, candidate, document, min_size, engine, max_open_pages)
+        best.evaluated += 1
+        temperature = START_TEMPERATURE * page_area * max(0.0, (deadline - time()) / max(deadline - started, 1e-9))
+        if cost <= current_cost or (temperature and rng.random() < math.exp((current_cost - cost) / temperature)):
+            current, current_cost = candidate, cost
+        if cost < best.cost:
+            best.cost, best.arrangement = cost, candidate
+            stalled = 0
+        else:
+            stalled += 1
+        if stalled >= RESTART_AFTER:
+            current = restart(images, rng)
+            current_cost = evaluate(images, current, document, min_size, engine, max_open_pages)
+            best.evaluated += 1
+            stalled = 0
+    return best
+
+
+def search_layout(images: list[VirtualImage], document: VirtualDocument, min_size: float, engine: str,
+                  budget: float, progress_callback: Callable[[int, Optional[str]], None] = silent_progress,
+                  max_workers: Optional[int] = None, seed: int = 0,
+                  max_open_pages: Optional[int] = None) -> list[VirtualImage]:
+    if budget <= 0 or len(images) < 2:
+        return images
+    started = time()
+    deadline = started + budget
+    baseline = evaluate(images, [(index, False) for index in range(len(images))], document, min_size, engine,
+                        max_open_pages)
+    max_workers = max(1, max_workers or os.cpu_count() or 1)
+    progress_callback(0, 'search')
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=max_workers) as executor:
+        stop = manager.Event()
+        # The first worker starts from the packer's order, the others from reordered ones.
+        futures = [executor.submit(search_worker, images, document, min_size, engine, deadline, seed + worker,
+                                   worker > 0, stop, max_open_pages)
+                   for worker in range(max_workers)]
+        try:
+            while True:
+                done, pending = wait(futures, timeout=POLL_INTERVAL, return_when=FIRST_EXCEPTION)
+                if not pending or any(future.exception() for future in done):
+                    break
+                progress_callback(min(100, math.floor((time() - started) / budget * 100)))
+            results = [future.result() for future in futures]
+        except BaseException:
+            stop.set()
+            raise
+    progress_callback(100)
+    evaluated = sum(result.evaluated for result in results)
+    best = min(results, key=lambda result: result.cost)
+    page_area = document.page_width * document.page_height
+    if best.cost >= baseline:
+        logger.info(f'Layout search tried {evaluated} layouts in {time() - started:.1f}s, '
+                    f'none beat the packer order')
+        return images
+    baseline_pages, baseline_fill = pages_and_last_fill(baseline, page_area)
+    best_pages, best_fill = pages_and_last_fill(best.cost, page_area)
+    logger.info(f'Layout search tried {evaluated} layouts in {time() - started:.1f}s: {baseline_pages} pages with '
+                f'the last {baseline_fill:.0%} full became {best_pages} pages with the last {best_fill:.0%} full')
+    return arrange(images, best.arrangement)
@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_VERSION = 1
+LAYOUT_SUFFIX = '.layout.json'
+
+
+@dataclass
+class SavedLayout:
+    parameters: dict
+    # path -> [fitted width, fitted height, rotated, file size, mtime_ns]
+    sources: dict[str, list]
+    # Each page is a list of [path, x, y, width, height, rotated] as placed.
+    pages: list[list[list]]
+    engine_state: dict
+    min_size: float
+    pdf: list = field(default_factory=list)
+    version: int = LAYOUT_VERSION
+
+
+def layout_path(output_pdf_path: str) -> str:
+    return os.path.splitext(output_pdf_path)[0] + LAYOUT_SUFFIX
+
+
+def file_stamp(path: str) -> Optional[list[int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_layout(path: str) -> Optional[SavedLayout]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f'Could not read the saved layout {path}: {e}')
+        return None
+    if not isinstance(data, dict) or data.get('version') != LAYOUT_VERSION:
+        logger.info(f'The saved layout {path} has an unsupported version')
+        return None
+    try:
+        return SavedLayout(**data)
+    except TypeError as e:
+        logger.warning(f'The saved layout {path} is malformed: {e}')
+        return None
+
+
+def save_layout(path: str, layout: SavedLayout):
+    partial_path = path + '.partial'
+    with open(partial_path, 'w', encoding='utf-8') as f:
+        json.dump(asdict(layout), f, separators=(',', ':'))
+    os.replace(partial_path, path)
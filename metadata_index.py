@@ -0,0 +1,128 @@
+import logging
+import os
+import sqlite3
+from time import time
+from typing import Optional
+
+from scanner import ImageInfo, checked_digest, checked_probe
+from talelle_setup import TALELLE_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_PATH = os.path.join(TALELLE_DIR, 'image_index.sqlite')
+DEFAULT_MAX_ENTRIES = 200_000
+# Batch runs share the index between processes, so wait for the other writers instead of failing.
+SQLITE_TIMEOUT = 60
+
+
+class MetadataIndex:
+    def __init__(self, db_path: str = DEFAULT_INDEX_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(db_path, timeout=SQLITE_TIMEOUT)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS images ('
+            'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, '
+            'width INTEGER NOT NULL, height INTEGER NOT NULL, format TEXT, orientation INTEGER NOT NULL, '
+            'last_used REAL NOT NULL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS images_last_used ON images (last_used)')
+        # Content digests for duplicate detection, kept apart so an image probed again does not lose its row.
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS digests ('
+            'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL)'
+        )
+        self.known: dict[str, tuple[int, int, ImageInfo]] = {}
+        self.known_digests: dict[str, tuple[int, int, str]] = {}
+        self.stats: dict[str, tuple[int, int]] = {}
+        self.hits: list[str] = []
+        self.probed: list[tuple[ImageInfo, int, int]] = []
+        self.hashed: list[tuple[str, int, int, str]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def load(self, directory: str):
+        prefix = os.path.join(directory, '')
+        rows = self.connection.execute(
+            'SELECT path, size, mtime_ns, width, height, format, orientation FROM images '
+            'WHERE substr(path, 1, ?) = ?', (len(prefix), prefix)
+        )
+        self.known = {path: (size, mtime_ns, ImageInfo(path, width, height, image_format, orientation))
+                      for path, size, mtime_ns, width, height, image_format, orientation in rows}
+        rows = self.connection.execute(
+            'SELECT path, size, mtime_ns, digest FROM digests WHERE substr(path, 1, ?) = ?', (len(prefix), prefix)
+        )
+        self.known_digests = {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in rows}
+        self.stats = {}
+        self.hits = []
+        self.probed = []
+        self.hashed = []
+        logger.debug(f'Loaded {len(self.known)} indexed images under {directory}')
+
+    def probe(self, path: str) -> Optional[ImageInfo]:
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            logger.warning(f'The file {path} could not be read: {e}')
+            return None
+        self.stats[path] = (st.st_size, st.st_mtime_ns)
+        known = self.known.get(path)
+        if known is not None and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            self.hits.append(path)
+            return known[2]
+        info = checked_probe(path)
+        if info is not None:
+            self.probed.append((info, st.st_size, st.st_mtime_ns))
+        return info
+
+    def digest(self, path: str) -> Optional[str]:
+        # Only files probed in this scan are looked up, their size and modification time are known already.
+        stat = self.stats.get(path)
+        known = self.known_digests.get(path)
+        if stat is not None and known is not None and known[:2] == stat:
+            return known[2]
+        digest = checked_digest(path)
+        if digest is not None and stat is not None:
+            self.hashed.append((path, stat[0], stat[1], digest))
+        return digest
+
+    def commit(self, directory: str):
+        now = time()
+        valid = set(self.hits)
+        valid.update(info.path for info, _, _ in self.probed)
+        stale = [(path,) for path in self.known if path not in valid]
+        with self.connection:
+            self.connection.executemany('DELETE FROM images WHERE path = ?', stale)
+            self.connection.executemany('DELETE FROM digests WHERE path = ?',
+                                        [(path,) for path in self.known_digests if path not in valid])
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO digests (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)', self.hashed
+            )
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO images (path, size, mtime_ns, width, height, format, orientation, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(info.path, size, mtime_ns, info.width, info.height, info.format, info.orientation, now)
+                 for info, size, mtime_ns in self.probed]
+            )
+            self.connection.executemany('UPDATE images SET last_used = ? WHERE path = ?',
+                                        [(now, path) for path in self.hits])
+            self.evict()
+        logger.info(f'Metadata index for {directory}: {len(self.hits)} unchanged, {len(self.probed)} probed, '
+                    f'{len(self.hashed)} hashed, {len(stale)} stale entries removed')
+
+    def evict(self):
+        count = self.connection.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.connection.execute(
+                'DELETE FROM images WHERE path IN (SELECT path FROM images ORDER BY last_used LIMIT ?)', (excess,)
+            )
+            self.connection.execute('DELETE FROM digests WHERE path NOT IN (SELECT path FROM images)')
+            logger.info(f'Evicted {excess} least recently used entries from the metadata index')
@@ -0,0 +1,118 @@
+import logging
+import math
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Optional, TYPE_CHECKING
+
+import instrumentation
+import placement
+from placement import VirtualDocument, VirtualImage
+from progress import silent_progress
+
+if TYPE_CHECKING:
+    from image_table import ImageTable
+    from metadata_index import MetadataIndex
+
+logger = logging.getLogger(__name__)
+
+MAX_TRIES = 40
+# The search stops once the box is known to within this share of its size.
+PRECISION = 0.002
+# A fit whose smallest fitted side is below this is reported as not fitting rather than printed as specks.
+MIN_PRINTABLE_CM = 0.1
+
+
+@dataclass
+class PageBudgetFit:
+    scale: float
+    max_width_cm: float
+    max_height_cm: float
+    pages: int
+    images: list[VirtualImage]
+    min_size: float
+    tries: int
+
+
+def count_pages(images: list[VirtualImage], document: VirtualDocument, min_size: float, engine: str,
+                max_open_pages: Optional[int] = None) -> int:
+    virtual_canvas = placement.get_engine(engine, max_open_pages).pack(images, document, min_size,
+                                                                       progress_callback=silent_progress)
+    pages = len(virtual_canvas.canvas)
+    if pages > 1 and not virtual_canvas.canvas[-1]:
+        pages -= 1
+    return pages
+
+
+def fit_to_pages(table: 'ImageTable', max_width_cm: float, max_height_cm: float, target_pages: int,
+                 document: VirtualDocument, engine: str = placement.ShelfEngine.name, copies: int = 1,
+                 progress_callback: Callable[[int, Optional[str]], None] = silent_progress,
+                 max_open_pages: Optional[int] = None) -> Optional[PageBudgetFit]:
+    # Binary search for the largest scale of the max width and height box whose layout needs at most
+    # `target_pages` pages. Only the probed dimensions are refitted and packed, nothing is rendered.
+    box_width, box_height = placement.max_box_points(max_width_cm, max_height_cm)
+    # The fitted images stand upright, so the box may grow until it fills the printable area.
+    highest = min((document.page_width - 2 * document.margin) / box_width,
+                  (document.page_height - 2 * document.margin) / box_height)
+    lowest = 0.0
+    best = None
+    tries = 0
+    min_printable = placement.cm_to_points(MIN_PRINTABLE_CM)
+    too_small = False
+
+    def attempt(scale: float) -> Optional[PageBudgetFit]:
+        nonlocal too_small
+        fitted = table.fit(box_width * scale, box_height * scale)
+        if fitted.min_size < min_printable:
+            # Every smaller scale only shrinks the images further.
+            logger.debug('Scale %.4f makes the smallest side %.1f points, too small to print', scale,
+                         fitted.min_size)
+            too_small = True
+            return None
+        images = placement.virtual_images(table, fitted, copies)
+        pages = count_pages(images, document, fitted.min_size, engine, max_open_pages)
+        logger.debug('Scale %.4f needs %d pages', scale, pages)
+        if pages > target_pages:
+            return None
+        return PageBudgetFit(scale, max_width_cm * scale, max_height_cm * scale, pages, images, fitted.min_size,
+                             0)
+
+    progress_callback(0, 'calculation')
+    scale = highest
+    with instrumentation.span('fit_pages'):
+        while tries < MAX_TRIES:
+            tries += 1
+            fit = attempt(scale)
+            if fit is not None:
+                best = fit
+                lowest = scale
+            elif too_small:
+                break
+            else:
+                highest = scale
+            if best is not None and highest - lowest <= PRECISION * highest:
+                break
+            progress_callback(math.floor(tries / MAX_TRIES * 100))
+            scale = (lowest + highest) / 2
+    if best is None:
+        logger.warning(f'The images do not fit on {target_pages} pages at any printable size')
+        return None
+    best.tries = tries
+    logger.info(f'Fitting to {target_pages} pages: a {best.max_width_cm:.2f} x {best.max_height_cm:.2f} cm box '
+                f'needs {best.pages} pages, found in {tries} tries')
+    return best
+
+
+def collect_and_fit_to_pages(directory: str, max_width_cm: float, max_height_cm: float, target_pages: int,
+                             document: VirtualDocument,
+                             progress_callback: Callable[[int, Optional[str]], None] = silent_progress,
+                             max_workers: Optional[int] = None,
+                             index: Optional['MetadataIndex'] = None,
+                             copies: int = 1,
+                             engine: str = placement.ShelfEngine.name,
+                             max_open_pages: Optional[int] = None) -> PageBudgetFit:
+    table = placement.scan_images(directory, progress_callback, max_workers, index)
+    fit = fit_to_pages(table, max_width_cm, max_height_cm, target_pages, document, engine, copies, progress_callback,
+                       max_open_pages)
+    if fit is None:
+        raise ValueError(f'The images do not fit on {target_pages} pages')
+    return fit
@@ -0,0 +1,71 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from reportlab.lib.pagesizes import A3, A4, A5, LEGAL, LETTER
+
+# PDF points are 1/72 inch.
+POINTS_PER_CM = 72 / 2.54
+LANDSCAPE_SUFFIX = '-landscape'
+CUSTOM_FORMAT = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*x\s*(\d+(?:\.\d+)?)\s*(?:cm)?\s*$', re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class PageFormat:
+    name: str
+    width: float
+    height: float
+    sheet_cost: Optional[float] = None
+
+    @property
+    def area(self) -> float:
+        return self.width * self.height
+
+    def landscape(self) -> 'PageFormat':
+        return PageFormat(self.name + LANDSCAPE_SUFFIX, max(self.width, self.height), min(self.width, self.height),
+                          self.sheet_cost)
+
+    def with_cost(self, sheet_cost: Optional[float]) -> 'PageFormat':
+        return PageFormat(self.name, self.width, self.height, sheet_cost)
+
+
+STANDARD_FORMATS = {page_format.name: page_format for page_format in (
+    PageFormat('A3', *A3),
+    PageFormat('A4', *A4),
+    PageFormat('A5', *A5),
+    PageFormat('Letter', *LETTER),
+    PageFormat('Legal', *LEGAL),
+)}
+DEFAULT_FORMAT = STANDARD_FORMATS['A4']
+
+
+def standard_formats() -> list[PageFormat]:
+    return [variant for page_format in STANDARD_FORMATS.values()
+            for variant in (page_format, page_format.landscape())]
+
+
+def parse_page_format(spec: str) -> PageFormat:
+    # "A4", "A4-landscape" or a custom "WIDTHxHEIGHT" in cm, such as a roll width and a cut length.
+    # "=COST" after any of them sets the price of one sheet.
+    name, _, cost = spec.partition('=')
+    try:
+        sheet_cost = float(cost) if cost else None
+    except ValueError:
+        raise ValueError(f'Invalid sheet cost in page format {spec}')
+    name = name.strip()
+    landscape = name.lower().endswith(LANDSCAPE_SUFFIX)
+    if landscape:
+        name = name[:-len(LANDSCAPE_SUFFIX)]
+    for standard_name, page_format in STANDARD_FORMATS.items():
+        if standard_name.lower() == name.lower():
+            page_format = page_format.with_cost(sheet_cost)
+            return page_format.landscape() if landscape else page_format
+    custom = CUSTOM_FORMAT.match(name)
+    if custom is None or landscape:
+        raise ValueError(f'Unknown page format {spec}, expected one of {", ".join(STANDARD_FORMATS)} '
+                         f'with an optional {LANDSCAPE_SUFFIX}, or WIDTHxHEIGHT in cm')
+    width, height = float(custom.group(1)), float(custom.group(2))
+    if not width or not height:
+        raise ValueError(f'Page format {spec} has no area')
+    return PageFormat(f'{custom.group(1)}x{custom.group(2)}cm', width * POINTS_PER_CM, height * POINTS_PER_CM,
+                      sheet_cost)
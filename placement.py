@@ -1,30 +1,70 @@
 import logging
-from collections.abc import Callable
-from dataclasses import dataclass, field
-from typing import Optional
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field, replace
+from typing import Optional, TYPE_CHECKING
 
-from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
-from PIL import Image, UnidentifiedImageError
 import math
-import bisect
-from time import time
+import multiprocessing
 import os
+import queue
+from time import time
+import tempfile
+
+import instrumentation
+import scanner
+from free_space import FreeSpaceIndex
+from layout_report import LayoutReport
+from layout_store import SavedLayout, file_stamp, layout_path, load_layout, save_layout
+from page_formats import DEFAULT_FORMAT, POINTS_PER_CM, PageFormat
+from progress import JobCancelled
+from resampler import RenderOptions, ResampleJob, iter_resampled, resample_job
+from variant_cache import PARTIAL_SUFFIX, VariantCache
+from scanner import ImageInfo
+
+# The PDF writer and NumPy are imported on first use, so the GUI and the CLI start without them.
+if TYPE_CHECKING:
+    from reportlab.pdfgen.canvas import Canvas
 
-from reportlab.pdfgen.canvas import Canvas
+    from image_table import FittedImages, ImageTable
+    from metadata_index import MetadataIndex
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass
+# Maps the unit square a stored image is drawn in onto the upright picture, per EXIF orientation,
+# as the (a, b, c, d, e, f) of a PDF transformation matrix.
+ORIENTATION_MATRICES = {
+    1: (1, 0, 0, 1, 0, 0),
+    2: (-1, 0, 0, 1, 1, 0),
+    3: (-1, 0, 0, -1, 1, 1),
+    4: (1, 0, 0, -1, 0, 1),
+    5: (0, -1, -1, 0, 1, 1),
+    6: (0, -1, 1, 0, 0, 1),
+    7: (0, 1, 1, 0, 0, 0),
+    8: (0, 1, -1, 0, 1, 0),
+}
+
+
+@dataclass(slots=True)
 class VirtualImage:
     path: str
     width: float
     height: float
     rotated: bool
+    source: Optional[str] = None
+    # The EXIF orientation of the file, applied when the original is drawn.
+    orientation: int = 1
+
+    @property
+    def embedded(self) -> str:
+        return self.source or self.path
 
-    def __post_init__(self):
-        logger.debug(f'Resized image to be placed {self}')
     def __eq__(self, other):
         return (self.width == other.width) and (self.height == other.height)
     def __lt__(self, other):
@@ -32,82 +72,263 @@ class VirtualImage:
     def __repr__(self):
         return f'{str(self.width)}x{str(self.height)}(rotated={str(self.rotated)})'
 
-@dataclass
+@dataclass(slots=True)
 class VirtualPlacement:
     image: VirtualImage
     x: float
     y: float
 
 
+class PageColumns:
+    __slots__ = ('images', 'xs', 'ys')
+
+    def __init__(self):
+        self.images: list[VirtualImage] = []
+        self.xs = array('d')
+        self.ys = array('d')
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def __iter__(self) -> Iterator[VirtualPlacement]:
+        for image, x, y in zip(self.images, self.xs, self.ys):
+            yield VirtualPlacement(image, x, y)
+
+    def append(self, image: VirtualImage, x: float, y: float):
+        self.images.append(image)
+        self.xs.append(x)
+        self.ys.append(y)
+
+
 class VirtualCanvas:
-    def __init__(self, progress_callback: Callable):
-        self.canvas = [[]]
+    def __init__(self, progress_callback: Callable, pagesize: tuple[float, float] = A4):
+        self.pagesize = pagesize
+        self.canvas = [PageColumns()]
+        self.page_used_areas = [0.0]
+        self.page_images = [0]
         self.current_page = 0
         self.length = 0
         self.progress_callback = progress_callback
+        self.real: Optional['Canvas'] = None
+        self.output_pdf_path = None
+        self.render_options = RenderOptions()
+        self.resources = ExitStack()
+        self.resampled_dir = None
+        self.cache = None
+        self.executor = None
+        self.variants: dict[ResampleJob, Optional[str]] = {}
+        self.flushed = 0
+        self.drawn = 0
 
     def showPage(self):
-        self.canvas.append([])
+        self.canvas.append(PageColumns())
+        self.page_used_areas.append(0.0)
+        self.page_images.append(0)
         self.current_page += 1
 
     def drawImage(self, image: VirtualImage, x: float, y: float, page: int=None):
         if page is None:
             page = self.current_page
-        self.canvas[page].append(VirtualPlacement(image, x, y))
+        self.canvas[page].append(image, x, y)
+        self.page_used_areas[page] += image.width * image.height
+        self.page_images[page] += 1
         self.length += 1
 
-    def makeItReal(self, output_pdf_path: str):
-        real = canvas.Canvas(output_pdf_path, pagesize=A4)
-        done = 0
-        placed_progress = 0
+    def openReal(self, output_pdf_path: str, render_options: Optional[RenderOptions] = None):
+        if render_options is not None:
+            self.render_options = render_options
+        self.resampled_dir = self.resources.enter_context(tempfile.TemporaryDirectory(prefix='collage-'))
+        if self.render_options.resample:
+            if self.render_options.cache_budget:
+                self.cache = self.resources.enter_context(VariantCache(max_bytes=self.render_options.cache_budget))
+            self.executor = self.resources.enter_context(ProcessPoolExecutor(max_workers=self.render_options.workers))
+        from reportlab.pdfgen.canvas import Canvas
+
+        # The PDF is written next to the output and only moved over it once complete.
+        self.output_pdf_path = output_pdf_path
+        self.real = Canvas(output_pdf_path + PARTIAL_SUFFIX, pagesize=self.pagesize)
+        self.real.saveState()
+
+    def saveReal(self):
+        with instrumentation.span('write'):
+            self.real.save()
+        os.replace(self.output_pdf_path + PARTIAL_SUFFIX, self.output_pdf_path)
+
+    def closeReal(self):
+        self.resources.close()
+        if self.real is not None:
+            remove_partial(self.output_pdf_path)
+        self.real = None
+
+    # Writes the pages before the oldest open one, so the PDF keeps the layout's page order in every mode. The
+    # engines close their oldest pages first when `max_open_pages` is set, which keeps the unwritten pages bounded.
+    def flush(self, open_pages: Optional[set[int]] = None, report: bool = False,
+              on_page: Optional[Callable[[int], None]] = None):
+        end = len(self.canvas)
+        if open_pages:
+            end = min(end, min(open_pages))
+        if end <= self.flushed:
+            return
+        pages = self.canvas[self.flushed:end]
+        if report:
+            self.progress_callback(math.floor((self.drawn / self.length)*100), 'placement')
+        start_time = time()
+        variants = self.resampled(pages)
+        try:
+            for page in pages:
+                for placement in page:
+                    variant = None
+                    if variants is not None:
+                        with instrumentation.span('resample'):
+                            _, variant = next(variants)
+                    if variant is not None:
+                        self.drawRealDirect(self.real, placement, variant)
+                    else:
+                        self.drawReal(self.real, placement)
+                    self.drawn += 1
+                    if report:
+                        self.updateProgress(self.drawn)
+                    else:
+                        self.checkCancelled()
+                self.real.showPage()
+                instrumentation.count('pages_flushed')
+                if on_page is not None:
+                    on_page(len(page))
+        finally:
+            if variants is not None:
+                variants.close()
+        for number in range(self.flushed, end):
+            self.canvas[number] = PageColumns()
+        logger.debug('Flushed pages %d..%d in %s', self.flushed, end - 1, time() - start_time)
+        self.flushed = end
+
+    def resampled(self, pages: list[PageColumns]) -> Optional[Iterator[tuple[ResampleJob, Optional[str]]]]:
+        if not self.render_options.resample:
+            return None
+        dpi = self.render_options.dpi
+        # Workers decode and resample ahead of the writer, which takes the results in page order.
+        jobs = (self.resampleJob(placement, dpi) for page in pages for placement in page)
+        return iter_resampled(jobs, self.resampled_dir, self.render_options, self.cache, self.executor,
+                              done=self.variants, check_cancelled=self.checkCancelled)
+
+    def makeItReal(self, output_pdf_path: str, render_options: Optional[RenderOptions] = None):
         if not self.canvas[-1]:
             self.canvas.pop()
+        if render_options is not None and render_options.shards > 1 and self.real is None:
+            self.makeItRealSharded(output_pdf_path, render_options)
+            return
+        if self.real is None:
+            self.openReal(output_pdf_path, render_options)
         start_time = time()
-        real.saveState()
-        logger.debug(f'Placing {self.length} images on {len(self.canvas)} pages')
-        self.progress_callback(placed_progress, 'placement')
-        for page in self.canvas:
-            for placement in page:
-                self.drawReal(real, placement)
-                done = self.updateProgress(done)
-            real.showPage()
-        real.save()
+        try:
+            logger.debug(f'Placing {self.length - self.drawn} images on {len(self.canvas) - self.flushed} pages')
+            self.flush(report=True)
+            self.saveReal()
+        finally:
+            self.closeReal()
         duration = time() - start_time
         logger.debug(f'Overall placement duration = {duration}')
 
-    def updateProgress(self, done: int) -> int:
-        done += 1
+    def makeItRealSharded(self, output_pdf_path: str, render_options: RenderOptions):
+        shards = split_pages(self.canvas, render_options.shards)
+        shard_options = replace(render_options, shards=1,
+                                workers=max(1, (render_options.workers or os.cpu_count() or 1) // len(shards)))
+        placed_progress = 0
+        start_time = time()
+        logger.debug(f'Placing {self.length} images on {len(self.canvas)} pages in {len(shards)} shards')
+        self.progress_callback(placed_progress, 'placement')
+        with (tempfile.TemporaryDirectory(prefix='collage-shards-') as shards_dir,
+              multiprocessing.Manager() as manager,
+              ProcessPoolExecutor(max_workers=len(shards)) as executor):
+            drawn_queue = manager.Queue()
+            cancel_event = manager.Event()
+            shard_paths = [os.path.join(shards_dir, f'shard-{number}.pdf') for number in range(len(shards))]
+            futures = [executor.submit(render_shard, pages, shard_path, shard_options, drawn_queue, cancel_event,
+                                       self.pagesize)
+                       for pages, shard_path in zip(shards, shard_paths)]
+            try:
+                while self.drawn < self.length and not all(future.done() for future in futures):
+                    try:
+                        self.drawn += drawn_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    self.updateProgress(self.drawn)
+                for future in futures:
+                    future.result()
+            except BaseException:
+                cancel_event.set()
+                for future in futures:
+                    future.cancel()
+                raise
+            with instrumentation.span('write'):
+                concatenate_pdfs(shard_paths, output_pdf_path)
+        self.drawn = self.length
+        self.updateProgress(self.drawn)
+        self.flushed = len(self.canvas)
+        duration = time() - start_time
+        logger.debug(f'Overall sharded placement duration = {duration}')
+
+    @staticmethod
+    def resampleJob(placement: VirtualPlacement, dpi: int) -> ResampleJob:
+        image = placement.image
+        return resample_job(image.embedded, image.width, image.height, image.rotated, dpi, image.orientation)
+
+    # Streaming writes pages between the packer's progress reports, so a long flush checks on its own.
+    def checkCancelled(self):
+        check_cancelled = getattr(self.progress_callback, 'check_cancelled', None)
+        if check_cancelled is not None:
+            check_cancelled()
+
+    def updateProgress(self, done: int):
         placed_progress = math.floor((done / self.length)*100)
-        logger.debug(f'PLACEMENT IS DONE for {placed_progress}%: {done} of {self.length}')
+        logger.debug('PLACEMENT IS DONE for %d%%: %d of %d', placed_progress, done, self.length)
         self.progress_callback(placed_progress)
-        return done
 
+    # reportlab embeds a file once per document and reuses it for every later drawImage of the same path.
+    # JPEG files are embedded as they are, see jpeg_passthrough.
     @classmethod
-    def drawReal(cls, real: Canvas, placement: VirtualPlacement):
-        if placement.image.rotated:
-            cls.drawRealRotated(real, placement)
+    def drawReal(cls, real: 'Canvas', placement: VirtualPlacement):
+        if placement.image.orientation != 1:
+            cls.drawRealOriented(real, placement, placement.image.embedded)
+        elif placement.image.rotated:
+            cls.drawRealRotated(real, placement, placement.image.embedded)
         else:
-            cls.drawRealDirect(real, placement)
+            cls.drawRealDirect(real, placement, placement.image.embedded)
 
     @staticmethod
-    def drawRealRotated(real: Canvas, placement: VirtualPlacement):
-        start_time = time()
-        real.saveState()
-        real.rotate(90)
-        #real.rect(y, -x-w, h, w, fill=0)
-        real.drawImage(placement.image.path, placement.y, -(placement.image.width+placement.x),
-                       width=placement.image.height, height=placement.image.width)
-        real.restoreState()
-        duration = time() - start_time
-        logger.debug(f'drawRealRotated-placement duration = {duration}')
+    def drawRealRotated(real: 'Canvas', placement: VirtualPlacement, source: str):
+        from jpeg_passthrough import draw_image
+
+        with instrumentation.span('encode'):
+            real.saveState()
+            real.rotate(90)
+            #real.rect(y, -x-w, h, w, fill=0)
+            draw_image(real, source, placement.y, -(placement.image.width+placement.x),
+                       placement.image.height, placement.image.width)
+            real.restoreState()
 
     @staticmethod
-    def drawRealDirect(real: Canvas, placement: VirtualPlacement):
-        start_time = time()
-        real.drawImage(placement.image.path, placement.x, placement.y,
-                       width=placement.image.width, height=placement.image.height)
-        duration = time() - start_time
-        logger.debug(f'drawRealDirect duration = {duration}')
+    def drawRealOriented(real: 'Canvas', placement: VirtualPlacement, source: str):
+        from jpeg_passthrough import draw_image
+
+        image = placement.image
+        a, b, c, d, e, f = ORIENTATION_MATRICES.get(image.orientation, ORIENTATION_MATRICES[1])
+        if image.rotated:
+            # Turn the upright picture a quarter counterclockwise, like drawRealRotated.
+            a, b, c, d, e, f = -b, a, -d, c, 1 - f, e
+        with instrumentation.span('encode'):
+            real.saveState()
+            real.transform(image.width * a, image.height * b, image.width * c, image.height * d,
+                           placement.x + image.width * e, placement.y + image.height * f)
+            draw_image(real, source, 0, 0, 1, 1)
+            real.restoreState()
+
+    @staticmethod
+    def drawRealDirect(real: 'Canvas', placement: VirtualPlacement, source: str):
+        from jpeg_passthrough import draw_image
+
+        with instrumentation.span('encode'):
+            draw_image(real, source, placement.x, placement.y, placement.image.width, placement.image.height)
 
 
 @dataclass
@@ -122,6 +343,10 @@ class VirtualDocument:
         self.padding = self.margin
         self.page_right = self.page_width - self.margin
 
+    @property
+    def pagesize(self) -> tuple[float, float]:
+        return self.page_width, self.page_height
+
 
 @dataclass
 class VirtualPosition:
@@ -137,83 +362,223 @@ class VirtualSpace:
     x: float
     y: float
     page: int
+    height: float = 0
 
     def __repr__(self):
         return f'{str(self.page)}x{str(self.x)}x{str(self.y)}({str(self.space)})'
 
 
-def cm_to_points(cm):
-    inches = cm / 2.54
-    return inches * 72
+def split_pages(pages: list[PageColumns], shards: int) -> list[list[PageColumns]]:
+    total = sum(len(page) for page in pages)
+    shards = max(1, min(shards, len(pages)))
+    split = [[]]
+    done = 0
+    for page in pages:
+        if split[-1] and done >= total * len(split) / shards:
+            split.append([])
+        split[-1].append(page)
+        done += len(page)
+    return split
 
 
-def resize_image(image_path: str, max_width_points: float, max_height_points: float) -> Optional[VirtualImage]:
+def render_shard(pages: list[PageColumns], shard_path: str, render_options: RenderOptions,
+                 drawn_queue, cancel_event=None, pagesize: tuple[float, float] = A4) -> str:
+    def on_page(drawn: int):
+        drawn_queue.put(drawn)
+        if cancel_event is not None and cancel_event.is_set():
+            raise JobCancelled()
+
+    virtual_canvas = VirtualCanvas(lambda value, label=None: None, pagesize)
+    virtual_canvas.canvas = pages
+    virtual_canvas.length = sum(len(page) for page in pages)
+    virtual_canvas.openReal(shard_path, render_options)
     try:
-        with Image.open(image_path) as img:
-            if img.height >= img.width:
-                rotated = False
-                width = img.width
-                height = img.height
-            else:
-                rotated = True
-                width = img.height
-                height = img.width
-
-            img_ratio = width / height
-            if img_ratio > max_width_points / max_height_points:
-                new_width = min(max_width_points, width)
-                new_height = int(new_width / img_ratio)
-            else:
-                new_height = min(max_height_points, height)
-                new_width = int(new_height * img_ratio)
+        virtual_canvas.flush(on_page=on_page)
+        virtual_canvas.saveReal()
+    finally:
+        virtual_canvas.closeReal()
+    return shard_path
 
-            return VirtualImage(image_path, new_width, new_height, rotated)
-    except UnidentifiedImageError:
-        logger.warning(f'The file {image_path} could not be identified as an image.')
+
+def remove_partial(output_pdf_path: str):
+    try:
+        os.remove(output_pdf_path + PARTIAL_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+def concatenate_pdfs(paths: list[str], output_pdf_path: str):
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for path in paths:
+        writer.append(path)
+    try:
+        with open(output_pdf_path + PARTIAL_SUFFIX, 'wb') as f:
+            writer.write(f)
+        os.replace(output_pdf_path + PARTIAL_SUFFIX, output_pdf_path)
+    finally:
+        writer.close()
+        remove_partial(output_pdf_path)
+
+
+def remaining_min_size(images: list[VirtualImage]) -> list[float]:
+    remaining = [math.inf] * (len(images) + 1)
+    for index in range(len(images) - 1, -1, -1):
+        image = images[index]
+        remaining[index] = min(remaining[index + 1], image.width, image.height)
+    return remaining
+
+
+def prune_unused(unused: FreeSpaceIndex, min_size: float):
+    unused.remove_below(min_size)
+
+
+def open_pages(position: VirtualPosition, right_unused: FreeSpaceIndex,
+               bottom_unused: FreeSpaceIndex) -> set[int]:
+    pages = {position.page}
+    pages.update(vs.page for vs in right_unused)
+    pages.update(vs.page for vs in bottom_unused)
+    return pages
+
+
+def preload_backends():
+    from PIL import Image
+    from reportlab.pdfgen import canvas
+
+    import image_table
+
+
+def default_progress_callback(value: int, label: str=None):
+    if label:
+        print(f'START REPORTING ON {label}')
+    for _ in range(value):
+        print('+', end = '')
+    for _ in range(value, 100):
+        print('-', end = '')
+    print()
+
+
+def project_output_path(project_path: str) -> str:
+    project_path = os.path.normpath(project_path)
+    project_name = os.path.basename(project_path)
+    parent_name = os.path.basename(os.path.dirname(project_path))
+    return os.path.join(project_path, f'{parent_name}_{project_name}.pdf')
+
+
+def cm_to_points(cm):
+    return cm * POINTS_PER_CM
+
+
+def fit_image(info: ImageInfo, max_width_points: float, max_height_points: float) -> VirtualImage:
+    upright_width, upright_height = info.upright_size
+    if upright_height >= upright_width:
+        rotated = False
+        width = upright_width
+        height = upright_height
+    else:
+        rotated = True
+        width = upright_height
+        height = upright_width
+
+    img_ratio = width / height
+    if img_ratio > max_width_points / max_height_points:
+        new_width = min(max_width_points, width)
+        new_height = int(new_width / img_ratio)
+    else:
+        new_height = min(max_height_points, height)
+        new_width = int(new_height * img_ratio)
+
+    return VirtualImage(info.path, new_width, new_height, rotated, orientation=info.orientation)
+
+
+def resize_image(image_path: str, max_width_points: float, max_height_points: float) -> Optional[VirtualImage]:
+    info = scanner.checked_probe(image_path)
+    if info is None:
         return None
+    return fit_image(info, max_width_points, max_height_points)
 
 
-def collect_and_resize_images(directory: str, max_width_cm: float, max_height_cm: float
-                              ) -> tuple[list[VirtualImage], float]:
+def max_box_points(max_width_cm: float, max_height_cm: float) -> tuple[float, float]:
     if max_width_cm <= max_height_cm:
-        max_width_points = cm_to_points(max_width_cm)
-        max_height_points = cm_to_points(max_height_cm)
-    else:
-        max_width_points = cm_to_points(max_height_cm)
-        max_height_points = cm_to_points(max_width_cm)
+        return cm_to_points(max_width_cm), cm_to_points(max_height_cm)
+    return cm_to_points(max_height_cm), cm_to_points(max_width_cm)
+
+
+def scan_images(directory: str,
+                progress_callback: Callable[[int, Optional[str]], None] = default_progress_callback,
+                max_workers: Optional[int] = None,
+                index: Optional['MetadataIndex'] = None) -> 'ImageTable':
+    from image_table import ImageTable
+
+    with instrumentation.span('scan'):
+        paths = list(scanner.iter_image_files(directory))
+        probe = scanner.checked_probe
+        if index is not None:
+            index.load(directory)
+            probe = index.probe
+        infos = scanner.probe_images(paths, probe, progress_callback, max_workers)
+        if index is not None:
+            duplicates = scanner.find_duplicates(infos, max_workers, index.digest, progress_callback)
+            index.commit(directory)
+        else:
+            duplicates = scanner.find_duplicates(infos, max_workers, progress_callback=progress_callback)
+        return ImageTable(infos, duplicates)
+
+
+def virtual_images(table: 'ImageTable', fitted: 'FittedImages', copies: int = 1) -> list[VirtualImage]:
+    paths = table.paths
+    sources = table.sources
+    orientations = table.orientations
+    widths = fitted.width.tolist()
+    heights = fitted.height.tolist()
+    rotated = fitted.rotated.tolist()
     images = []
-    min_size = min(max_width_points, max_height_points)
-    for root, _, files in os.walk(directory):
-        for filename in files:
-            path = f'{os.path.join(root, filename)}'
-            image = resize_image(path, max_width_points, max_height_points)
-            if image is not None:
-                min_size = min(min_size, image.width, image.height)
-                images.append(image)
-    images.sort(reverse=True)
-    return images, min_size
+    for i in fitted.order.tolist():
+        image = VirtualImage(paths[i], widths[i], heights[i], rotated[i],
+                             sources[i] if sources[i] != paths[i] else None, orientations[i])
+        # Copies share one VirtualImage, so they are placed apart but embedded once.
+        images.extend([image] * copies)
+    return images
+
+
+def fit_table(table: 'ImageTable', max_width_points: float, max_height_points: float, copies: int = 1
+              ) -> tuple[list[VirtualImage], float]:
+    with instrumentation.span('fit'):
+        fitted = table.fit(max_width_points, max_height_points)
+        images = virtual_images(table, fitted, copies)
+    logger.info(f'Fitted {len(table)} images, {int(fitted.rotated.sum())} rotated, smallest side {fitted.min_size}')
+    return images, fitted.min_size
+
+
+def collect_and_resize_images(directory: str, max_width_cm: float, max_height_cm: float,
+                              progress_callback: Callable[[int, Optional[str]], None] = default_progress_callback,
+                              max_workers: Optional[int] = None,
+                              index: Optional['MetadataIndex'] = None,
+                              copies: int = 1
+                              ) -> tuple[list[VirtualImage], float]:
+    table = scan_images(directory, progress_callback, max_workers, index)
+    return fit_table(table, *max_box_points(max_width_cm, max_height_cm), copies)
 
 
 def try_use_unused_right(
     virtual_canvas: VirtualCanvas,
-    right_unused: list[VirtualSpace],
+    right_unused: FreeSpaceIndex,
     image: VirtualImage,
     document: VirtualDocument,
     min_size: float
 ) -> bool:
-    wide_index = bisect.bisect_left(right_unused, image.width, key = lambda vs:vs.space)
-    wide_count = len(right_unused)
-    if wide_index < wide_count:
-        put_here = right_unused.pop(wide_index)
-        logger.debug(f'The image with rotation={image.rotated} of width {image.width} '
-                     f'can be inserted at free right space: {put_here}')
+    put_here = right_unused.pop_at_least(image.width)
+    if put_here is not None:
+        instrumentation.count('free_space_hits')
+        logger.debug('The image with rotation=%s of width %s can be inserted at free right space: %s',
+                     image.rotated, image.width, put_here)
         virtual_canvas.drawImage(image, put_here.x, put_here.y - image.height, page=put_here.page)
 
         new_x = put_here.x + image.width + document.padding
         new_space = document.page_right-new_x
         if new_x + min_size <= document.page_right:
-            bisect.insort_right(right_unused, VirtualSpace(new_space, new_x, put_here.y, put_here.page),
-                                key = lambda vs:vs.space)
+            right_unused.insert(VirtualSpace(new_space, new_x, put_here.y, put_here.page, put_here.height))
         return True
 
     return False
@@ -221,60 +586,59 @@ def try_use_unused_right(
 
 def try_use_unused_bottom(
     virtual_canvas: VirtualCanvas,
-    bottom_unused: list[VirtualSpace],
+    bottom_unused: FreeSpaceIndex,
     image: VirtualImage,
     document: VirtualDocument,
     min_size: float
 ) -> bool:
-    height_index = bisect.bisect_left(bottom_unused, image.height, key = lambda vs:vs.space)
-    height_count = len(bottom_unused)
-    while height_index < height_count:
-        put_here = bottom_unused[height_index]
-        if put_here.x + image.width <= document.page_right:
-            logger.debug(f'The image with rotation={image.rotated} of height {image.height} '
-                         f'can be inserted at free bottom space: {put_here}')
-            virtual_canvas.drawImage(image, put_here.x, put_here.y - image.height, page=put_here.page)
-            new_x = put_here.x + image.width + document.padding
-            if new_x + min_size <= document.page_right:
-                bottom_unused[height_index] = VirtualSpace(put_here.space, new_x, put_here.y, put_here.page)
-            else:
-                bottom_unused.pop(height_index)
-            break
-        else:
-            height_index += 1
-    if height_index < height_count:
-        return True
-    return False
+    found = bottom_unused.find_fit(image.height, image.width, document.page_right)
+    if found is None:
+        return False
+    put_here = bottom_unused.get(*found)
+    instrumentation.count('free_space_hits')
+    logger.debug('The image with rotation=%s of height %s can be inserted at free bottom space: %s',
+                 image.rotated, image.height, put_here)
+    virtual_canvas.drawImage(image, put_here.x, put_here.y - image.height, page=put_here.page)
+    new_x = put_here.x + image.width + document.padding
+    if new_x + min_size <= document.page_right:
+        bottom_unused.replace(*found, VirtualSpace(put_here.space, new_x, put_here.y, put_here.page))
+    else:
+        bottom_unused.pop(*found)
+    return True
 
 
 def rotate(image: VirtualImage) -> VirtualImage:
-    return VirtualImage(image.path, image.height, image.width, not image.rotated)
+    return VirtualImage(image.path, image.height, image.width, not image.rotated, image.source, image.orientation)
 
 
 def use_unused(
     virtual_canvas: VirtualCanvas,
-    right_unused: list[VirtualSpace],
-    bottom_unused: list[VirtualSpace],
+    right_unused: FreeSpaceIndex,
+    bottom_unused: FreeSpaceIndex,
     image: VirtualImage,
     document: VirtualDocument,
     min_size: float
 ) -> bool:
-    return try_use_unused_right(
+    if try_use_unused_right(
         virtual_canvas, right_unused, image, document, min_size
     ) or try_use_unused_bottom(
         virtual_canvas, bottom_unused, image, document, min_size
-    ) or try_use_unused_right(
-        virtual_canvas, right_unused, rotate(image), document, min_size
+    ):
+        return True
+    instrumentation.count('rotations_tried')
+    rotated = rotate(image)
+    return try_use_unused_right(
+        virtual_canvas, right_unused, rotated, document, min_size
     ) or try_use_unused_bottom(
-        virtual_canvas, bottom_unused, rotate(image), document, min_size
+        virtual_canvas, bottom_unused, rotated, document, min_size
     )
 
 
 def reposition(
     virtual_canvas: VirtualCanvas,
     position: VirtualPosition,
-    right_unused: list[VirtualSpace],
-    bottom_unused: list[VirtualSpace],
+    right_unused: FreeSpaceIndex,
+    bottom_unused: FreeSpaceIndex,
     image: VirtualImage,
     document: VirtualDocument,
     min_size: float
@@ -284,10 +648,12 @@ def reposition(
     elif position.x + image.width > document.page_right:
         space = document.page_right-position.x
         if space >= min_size:
-            vs = VirtualSpace(document.page_right-position.x, position.x, position.y, position.page)
+            vs = VirtualSpace(document.page_right-position.x, position.x, position.y, position.page,
+                              position.max_row_height)
             rooms = len(bottom_unused)
-            bisect.insort_right(right_unused, vs, key = lambda vs:vs.space)
-            logger.debug(f'add HORIZONTAL virtual space {vs}; current number of rooms: {rooms} => {len(right_unused)}')
+            right_unused.insert(vs)
+            logger.debug('add HORIZONTAL virtual space %s; current number of rooms: %d => %d',
+                         vs, rooms, len(right_unused))
         position.x = document.margin
         position.y -= position.max_row_height + document.padding
         position.max_row_height = image.height
@@ -297,11 +663,9 @@ def reposition(
             if space >= min_size:
                 vs = VirtualSpace(position.y - document.margin, document.margin, position.y, position.page)
                 rooms = len(bottom_unused)
-                bisect.insort_right(bottom_unused,
-                                    vs,
-                                    key = lambda vs:vs.space)
-                logger.debug(f'add VERTICAL virtual space {vs}; '
-                             f'current number of rooms: {rooms} => {len(bottom_unused)}')
+                bottom_unused.insert(vs)
+                logger.debug('add VERTICAL virtual space %s; current number of rooms: %d => %d',
+                             vs, rooms, len(bottom_unused))
             virtual_canvas.showPage()
             position.page += 1
             position.x, position.y = document.margin, document.page_height - document.margin
@@ -313,73 +677,511 @@ def draw_image(virtual_canvas: VirtualCanvas, position: VirtualPosition,
     position.x += image.width + document.padding
 
 
-def default_progress_callback(value: int, label: str=None):
-    if label:
-        print(f'START REPORTING ON {label}')
-    for _ in range(value):
-        print('+', end = '')
-    for _ in range(value, 100):
-        print('-', end = '')
-    print()
-
-
 def updateProgress(done: int, total: int, progress_callback: Callable):
     done += 1
     calculated_progress = math.floor((done / total)*100)
-    logger.debug(f'CALCULATION IS DONE for {calculated_progress}%: {str(done)} of {total}')
+    logger.debug('CALCULATION IS DONE for %d%%: %d of %d', calculated_progress, done, total)
     progress_callback(calculated_progress)
     return done
 
 
-def place_images_on_pdf(images: list[VirtualImage], output_pdf_path: str,
-                        margin: float, min_size: float,
-                        progress_callback: Callable[[int, Optional[str]], None] = default_progress_callback):
+# An engine that leaves out one of the abstract methods fails when it is created rather than in the middle of a job.
+class PackingEngine(ABC):
+    name = ''
 
-    virtual_canvas = VirtualCanvas(progress_callback)
-    document = VirtualDocument(margin)
-    position = VirtualPosition(document.margin, document.page_height - document.margin, 0, 0)
+    # A page stays open while a remaining image could still fill a gap on it, which with mixed sizes is most pages.
+    # `max_open_pages` gives up the gaps on the oldest pages beyond it, so streaming holds at most that many pages.
+    def __init__(self, max_open_pages: Optional[int] = None):
+        self.max_open_pages = max_open_pages
+        self.gap_placements = 0
+        self.row_placements = 0
 
-    right_unused = []
-    bottom_unused = []
+    @abstractmethod
+    def pack(self, images: list[VirtualImage], document: VirtualDocument, min_size: float,
+             virtual_canvas: Optional[VirtualCanvas] = None,
+             progress_callback: Callable[[int, Optional[str]], None] = default_progress_callback,
+             streaming: bool = False, resume: bool = False) -> VirtualCanvas:
+        ...
+
+    # The free space left on each page and in total, for the report.
+    @abstractmethod
+    def free_space(self, document: VirtualDocument) -> tuple[list[float], float]:
+        ...
+
+    # The packing state is saved with the layout, so a later pack(resume=True) can add images to it.
+    @abstractmethod
+    def state(self) -> dict:
+        ...
+
+    @abstractmethod
+    def restore(self, state: dict):
+        ...
+
+    def report(self, virtual_canvas: VirtualCanvas, document: VirtualDocument) -> LayoutReport:
+        pages = len(virtual_canvas.canvas)
+        free_space_areas, free_area = self.free_space(document)
+        return LayoutReport.build(self.name, document.page_width, document.page_height,
+                                  virtual_canvas.page_used_areas[:pages], virtual_canvas.page_images[:pages],
+                                  self.gap_placements, self.row_placements, free_space_areas, free_area)
+
+
+class ShelfEngine(PackingEngine):
+    name = 'shelf'
+    space_index = FreeSpaceIndex
+
+    def __init__(self, max_open_pages: Optional[int] = None):
+        super().__init__(max_open_pages)
+        self.position: Optional[VirtualPosition] = None
+        self.right_unused = self.space_index()
+        self.bottom_unused = self.space_index()
+
+    def pack(self, images: list[VirtualImage], document: VirtualDocument, min_size: float,
+             virtual_canvas: Optional[VirtualCanvas] = None,
+             progress_callback: Callable[[int, Optional[str]], None] = default_progress_callback,
+             streaming: bool = False, resume: bool = False) -> VirtualCanvas:
+        if virtual_canvas is None:
+            virtual_canvas = VirtualCanvas(progress_callback, document.pagesize)
+        if not resume:
+            self.position = VirtualPosition(document.margin, document.page_height - document.margin, 0, 0)
+            self.right_unused = self.space_index()
+            self.bottom_unused = self.space_index()
+        position, right_unused, bottom_unused = self.position, self.right_unused, self.bottom_unused
+        self.gap_placements = self.row_placements = 0
+
+        done = 0
+        total = len(images)
+        calculated_progress = 0
+        progress_callback(calculated_progress, 'calculation')
+        if streaming:
+            remaining_min_sizes = remaining_min_size(images)
+
+        for image in images:
+            page = position.page
+            reposition(virtual_canvas, position, right_unused, bottom_unused, image, document, min_size)
+            if use_unused(virtual_canvas, right_unused, bottom_unused, image, document, min_size):
+                self.gap_placements += 1
+            else:
+                draw_image(virtual_canvas, position, image, document)
+                self.row_placements += 1
+
+            done = updateProgress(done, total, progress_callback)
+            if position.page != page and self.max_open_pages is not None:
+                self.close_pages()
+            if streaming and position.page != page:
+                prune_unused(right_unused, remaining_min_sizes[done])
+                prune_unused(bottom_unused, remaining_min_sizes[done])
+                virtual_canvas.flush(open_pages(position, right_unused, bottom_unused))
+
+        logger.debug('Right still unused %s', right_unused)
+        logger.debug('Bottom still bottom unused %s', bottom_unused)
+        return virtual_canvas
+
+    def close_pages(self):
+        pages = open_pages(self.position, self.right_unused, self.bottom_unused)
+        if len(pages) <= self.max_open_pages:
+            return
+        pages.discard(self.position.page)
+        closing = set(sorted(pages)[:len(pages) + 1 - max(1, self.max_open_pages)])
+        self.right_unused.remove_if(lambda vs: vs.page in closing)
+        self.bottom_unused.remove_if(lambda vs: vs.page in closing)
+
+    def free_space(self, document: VirtualDocument) -> tuple[list[float], float]:
+        areas = [vs.space * vs.height for vs in self.right_unused]
+        areas.extend(vs.space * (document.page_right - vs.x) for vs in self.bottom_unused)
+        position = self.position
+        if position is not None:
+            # The rest of the current row and the rows below it on the last page.
+            areas.append(max(0, document.page_right - position.x) * position.max_row_height)
+            next_row = position.y - position.max_row_height - document.padding
+            areas.append(max(0, next_row - document.margin) * (document.page_right - document.margin))
+        areas = [area for area in areas if area > 0]
+        return areas, sum(areas)
+
+    def state(self) -> dict:
+        position = self.position
+        return {
+            'position': [position.x, position.y, position.max_row_height, position.page],
+            'right_unused': [[vs.space, vs.x, vs.y, vs.page, vs.height] for vs in self.right_unused],
+            'bottom_unused': [[vs.space, vs.x, vs.y, vs.page, vs.height] for vs in self.bottom_unused],
+        }
+
+    def restore(self, state: dict):
+        self.position = VirtualPosition(*state['position'])
+        self.right_unused = self.space_index()
+        self.bottom_unused = self.space_index()
+        for unused, key in ((self.right_unused, 'right_unused'), (self.bottom_unused, 'bottom_unused')):
+            for space in state[key]:
+                unused.insert(VirtualSpace(*space))
+
+
+@dataclass
+class FreeRect:
+    x: float
+    y: float
+    width: float
+    height: float
+
+    def contains(self, other: 'FreeRect') -> bool:
+        return (self.x <= other.x and self.y <= other.y and
+                other.x + other.width <= self.x + self.width and other.y + other.height <= self.y + self.height)
 
-    done = 0
-    total = len(images)
-    calculated_progress = 0
-    progress_callback(calculated_progress, 'calculation')
 
+def subtract_free_rect(free: FreeRect, used: FreeRect) -> list[FreeRect]:
+    if (used.x >= free.x + free.width or used.x + used.width <= free.x or
+            used.y >= free.y + free.height or used.y + used.height <= free.y):
+        return [free]
+    left = max(free.x, used.x)
+    right = min(free.x + free.width, used.x + used.width)
+    parts = []
+    if used.x > free.x:
+        parts.append(FreeRect(free.x, free.y, used.x - free.x, free.height))
+    if used.x + used.width < free.x + free.width:
+        parts.append(FreeRect(right, free.y, free.x + free.width - right, free.height))
+    if used.y > free.y:
+        parts.append(FreeRect(left, free.y, right - left, used.y - free.y))
+    if used.y + used.height < free.y + free.height:
+        parts.append(FreeRect(left, used.y + used.height, right - left, free.y + free.height - used.y - used.height))
+    return parts
+
+
+def union_area(rects: list[FreeRect]) -> float:
+    pieces = []
+    for rect in rects:
+        parts = [rect]
+        for piece in pieces:
+            parts = [part for other in parts for part in subtract_free_rect(other, piece)]
+        pieces.extend(parts)
+    return sum(piece.width * piece.height for piece in pieces)
+
+
+def split_free_rect(free: FreeRect, used: FreeRect) -> Optional[list[FreeRect]]:
+    if (used.x >= free.x + free.width or used.x + used.width <= free.x or
+            used.y >= free.y + free.height or used.y + used.height <= free.y):
+        return None
+    split = []
+    if used.x > free.x:
+        split.append(FreeRect(free.x, free.y, used.x - free.x, free.height))
+    if used.x + used.width < free.x + free.width:
+        split.append(FreeRect(used.x + used.width, free.y, free.x + free.width - used.x - used.width, free.height))
+    if used.y > free.y:
+        split.append(FreeRect(free.x, free.y, free.width, used.y - free.y))
+    if used.y + used.height < free.y + free.height:
+        split.append(FreeRect(free.x, used.y + used.height, free.width, free.y + free.height - used.y - used.height))
+    return split
+
+
+class MaxRectsEngine(PackingEngine):
+    name = 'maxrects'
+
+    def __init__(self, max_open_pages: Optional[int] = None):
+        super().__init__(max_open_pages)
+        self.free_rects: dict[int, list[FreeRect]] = {}
+        self.largest_short_side: dict[int, float] = {}
+
+    def pack(self, images: list[VirtualImage], document: VirtualDocument, min_size: float,
+             virtual_canvas: Optional[VirtualCanvas] = None,
+             progress_callback: Callable[[int, Optional[str]], None] = default_progress_callback,
+             streaming: bool = False, resume: bool = False) -> VirtualCanvas:
+        if virtual_canvas is None:
+            virtual_canvas = VirtualCanvas(progress_callback, document.pagesize)
+        # Every image is padded on its right and bottom, so the printable area grows by one padding to match.
+        bin_width = document.page_width - 2 * document.margin + document.padding
+        bin_height = document.page_height - 2 * document.margin + document.padding
+        if not resume:
+            self.free_rects = {0: [FreeRect(0, 0, bin_width, bin_height)]}
+            self.largest_short_side = {0: min(bin_width, bin_height)}
+        # MaxRects fills gaps best when the images with the longest short side are placed first.
+        images = sorted(images, key=lambda image: (min(image.width, image.height), max(image.width, image.height)),
+                        reverse=True)
+        remaining_min_sizes = remaining_min_size(images)
+        self.gap_placements = self.row_placements = 0
+
+        done = 0
+        total = len(images)
+        calculated_progress = 0
+        progress_callback(calculated_progress, 'calculation')
+
+        for image in images:
+            found = self.find_position(image, document.padding)
+            if found is None:
+                page = virtual_canvas.current_page + 1
+                virtual_canvas.showPage()
+                self.free_rects[page] = [FreeRect(0, 0, bin_width, bin_height)]
+                self.largest_short_side[page] = min(bin_width, bin_height)
+                found = self.find_position(image, document.padding)
+                if found is None:
+                    logger.warning(f'The image {image} does not fit on an empty page')
+                    found = (page, FreeRect(0, 0, image.width + document.padding, image.height + document.padding),
+                             image)
+            page, used, image = found
+            # Anything placed behind the newest page fills a gap left there earlier.
+            if page < virtual_canvas.current_page:
+                self.gap_placements += 1
+            else:
+                self.row_placements += 1
+            virtual_canvas.drawImage(image, document.margin + used.x,
+                                     document.page_height - document.margin - used.y - image.height, page=page)
+            done = updateProgress(done, total, progress_callback)
+            # After the last image keep what a later incremental run could still fill.
+            keep_size = remaining_min_sizes[done] if done < total else min_size
+            self.place(page, used, keep_size + document.padding)
+            closed = self.close_pages()
+            if streaming and closed:
+                virtual_canvas.flush(set(self.free_rects))
+
+        logger.debug('Still free rectangles %s', self.free_rects)
+        return virtual_canvas
+
+    def free_space(self, document: VirtualDocument) -> tuple[list[float], float]:
+        # Maximal free rectangles overlap, so the total is the area of their union on each page.
+        areas = [free.width * free.height for free_rects in self.free_rects.values() for free in free_rects]
+        return areas, sum(union_area(free_rects) for free_rects in self.free_rects.values())
+
+    def state(self) -> dict:
+        return {'free_rects': [[page, [[free.x, free.y, free.width, free.height] for free in free_rects]]
+                               for page, free_rects in self.free_rects.items()]}
+
+    def restore(self, state: dict):
+        self.free_rects = {page: [FreeRect(*free) for free in free_rects] for page, free_rects in state['free_rects']}
+        self.largest_short_side = {page: max((min(free.width, free.height) for free in free_rects), default=0)
+                                   for page, free_rects in self.free_rects.items()}
+
+    def find_position(self, image: VirtualImage, padding: float
+                      ) -> Optional[tuple[int, FreeRect, VirtualImage]]:
+        best = None
+        best_score = None
+        short_side = min(image.width, image.height) + padding
+        for page, free_rects in self.free_rects.items():
+            if self.largest_short_side[page] < short_side:
+                continue
+            for candidate in (image, rotate(image)):
+                width = candidate.width + padding
+                height = candidate.height + padding
+                for free in free_rects:
+                    if width <= free.width and height <= free.height:
+                        leftover_width = free.width - width
+                        leftover_height = free.height - height
+                        score = (min(leftover_width, leftover_height), max(leftover_width, leftover_height), page)
+                        if best_score is None or score < best_score:
+                            best_score = score
+                            best = (page, FreeRect(free.x, free.y, width, height), candidate)
+        return best
+
+    def place(self, page: int, used: FreeRect, min_size: float):
+        free_rects = []
+        for free in self.free_rects[page]:
+            split = split_free_rect(free, used)
+            free_rects.extend([free] if split is None else split)
+        free_rects = [free for free in free_rects if min(free.width, free.height) >= min_size]
+        self.free_rects[page] = [free for index, free in enumerate(free_rects)
+                                 if not any(other.contains(free) and (other != free or other_index < index)
+                                            for other_index, other in enumerate(free_rects) if other_index != index)]
+        self.largest_short_side[page] = max((min(free.width, free.height) for free in self.free_rects[page]), default=0)
+
+    def close_pages(self) -> bool:
+        closed = False
+        for page in sorted(self.free_rects):
+            too_many = self.max_open_pages is not None and len(self.free_rects) > self.max_open_pages
+            if not self.free_rects[page] or too_many:
+                if page == max(self.free_rects):
+                    break
+                del self.free_rects[page]
+                del self.largest_short_side[page]
+                closed = True
+        return closed
+
+
+ENGINES = {engine.name: engine for engine in (ShelfEngine, MaxRectsEngine)}
+
+
+def get_engine(name: str, max_open_pages: Optional[int] = None) -> PackingEngine:
+    try:
+        return ENGINES[name](max_open_pages)
+    except KeyError:
+        raise ValueError(f'Unknown packing engine {name}, expected one of {", ".join(ENGINES)}')
+
+
+def layout_parameters(document: VirtualDocument, engine: str, render_options: Optional[RenderOptions],
+                      max_open_pages: Optional[int] = None) -> dict:
+    render_options = render_options or RenderOptions()
+    return {
+        'engine': engine,
+        'max_open_pages': max_open_pages,
+        'margin': document.margin,
+        'page_width': document.page_width,
+        'page_height': document.page_height,
+        'dpi': render_options.dpi,
+        'jpeg_quality': render_options.jpeg_quality if render_options.resample else None,
+    }
+
+
+def capture_layout(images: list[VirtualImage], virtual_canvas: VirtualCanvas, packing_engine: PackingEngine,
+                   parameters: dict, min_size: float) -> SavedLayout:
+    sources = {image.path: [image.width, image.height, image.rotated, *(file_stamp(image.path) or [-1, -1])]
+               for image in images}
+    pages = [[[placement.image.path, placement.x, placement.y, placement.image.width, placement.image.height,
+               placement.image.rotated] for placement in page]
+             for page in virtual_canvas.canvas]
+    return SavedLayout(parameters, sources, pages, packing_engine.state(), min_size)
+
+
+def new_images_since(saved: Optional[SavedLayout], images: list[VirtualImage], parameters: dict,
+                     output_pdf_path: str) -> tuple[Optional[list[VirtualImage]], str]:
+    if saved is None:
+        return None, 'no saved layout'
+    if saved.parameters != parameters:
+        return None, 'layout parameters changed'
+    if not saved.pdf or file_stamp(output_pdf_path) != saved.pdf:
+        return None, 'the output PDF is missing or was changed'
+    placed = Counter(row[0] for page in saved.pages for row in page)
+    copies = Counter(image.path for image in images)
+    new_images = []
     for image in images:
-        reposition(virtual_canvas, position, right_unused, bottom_unused, image, document, min_size)
-        if not use_unused(virtual_canvas, right_unused, bottom_unused, image, document, min_size):
-            draw_image(virtual_canvas, position, image, document)
+        source = saved.sources.get(image.path)
+        if source is None:
+            new_images.append(image)
+        elif source != [image.width, image.height, image.rotated, *(file_stamp(image.path) or [-1, -1])]:
+            return None, f'{image.path} changed'
+        elif placed[image.path] != copies[image.path]:
+            return None, 'the number of copies changed'
+    if len(copies) - len({image.path for image in new_images}) != len(saved.sources):
+        return None, 'images were removed'
+    return new_images, ''
 
-        done = updateProgress(done, total, progress_callback)
 
-    virtual_canvas.makeItReal(output_pdf_path)
-    logger.info(f'Right still unused {right_unused}')
-    logger.info(f'Bottom still bottom unused {bottom_unused}')
+def load_canvas(saved: SavedLayout, images: list[VirtualImage],
+                progress_callback: Callable[[int, Optional[str]], None]) -> VirtualCanvas:
+    sources = {image.path: (image.source, image.orientation) for image in images}
+    pagesize = (saved.parameters['page_width'], saved.parameters['page_height'])
+    virtual_canvas = VirtualCanvas(progress_callback, pagesize)
+    for number, page in enumerate(saved.pages):
+        if number:
+            virtual_canvas.showPage()
+        for path, x, y, width, height, rotated in page:
+            virtual_canvas.drawImage(VirtualImage(path, width, height, rotated, *sources.get(path, (None, 1))), x, y)
+    return virtual_canvas
 
 
-def config_default_logging():
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler()
-        ]
-    )
+def render_changed_pages(virtual_canvas: VirtualCanvas, changed: list[int], output_pdf_path: str,
+                         render_options: Optional[RenderOptions]):
+    from pypdf import PdfReader, PdfWriter
+
+    render_options = replace(render_options or RenderOptions(), shards=1)
+    partial_path = output_pdf_path + PARTIAL_SUFFIX
+    with tempfile.TemporaryDirectory(prefix='collage-changed-') as changed_dir:
+        changed_path = os.path.join(changed_dir, 'changed.pdf')
+        changed_canvas = VirtualCanvas(virtual_canvas.progress_callback, virtual_canvas.pagesize)
+        changed_canvas.canvas = [virtual_canvas.canvas[number] for number in changed]
+        changed_canvas.length = sum(len(page) for page in changed_canvas.canvas)
+        changed_canvas.makeItReal(changed_path, render_options)
+        with instrumentation.span('write'):
+            rendered = dict(zip(changed, PdfReader(changed_path).pages))
+            previous = PdfReader(output_pdf_path)
+            writer = PdfWriter()
+            for number in range(len(virtual_canvas.canvas)):
+                writer.add_page(rendered[number] if number in rendered else previous.pages[number])
+            try:
+                with open(partial_path, 'wb') as f:
+                    writer.write(f)
+                os.replace(partial_path, output_pdf_path)
+            finally:
+                writer.close()
+                remove_partial(output_pdf_path)
+
+
+def place_images_incrementally(images: list[VirtualImage], output_pdf_path: str, document: VirtualDocument,
+                               min_size: float, progress_callback: Callable[[int, Optional[str]], None],
+                               render_options: Optional[RenderOptions], engine: str,
+                               max_open_pages: Optional[int] = None) -> Optional[LayoutReport]:
+    parameters = layout_parameters(document, engine, render_options, max_open_pages)
+    saved_path = layout_path(output_pdf_path)
+    saved = load_layout(saved_path)
+    new_images, reason = new_images_since(saved, images, parameters, output_pdf_path)
+    if new_images is None:
+        logger.info(f'Rebuilding the whole layout: {reason}')
+        return None
+
+    virtual_canvas = load_canvas(saved, images, progress_callback)
+    packing_engine = get_engine(engine, max_open_pages)
+    packing_engine.restore(saved.engine_state)
+    before = list(virtual_canvas.page_images)
+    with instrumentation.span('pack'):
+        packing_engine.pack(new_images, document, min_size, virtual_canvas, progress_callback, resume=True)
+    layout = capture_layout(images, virtual_canvas, packing_engine, parameters, min_size)
+    # The shelf engine may have opened a page it did not need, the PDF never has it.
+    if not virtual_canvas.canvas[-1]:
+        virtual_canvas.canvas.pop()
+    changed = [number for number in range(len(virtual_canvas.canvas))
+               if number >= len(before) or virtual_canvas.page_images[number] != before[number]]
+    if changed:
+        render_changed_pages(virtual_canvas, changed, output_pdf_path, render_options)
+    else:
+        progress_callback(100, 'placement')
+    layout.pdf = file_stamp(output_pdf_path)
+    save_layout(saved_path, layout)
+
+    report = packing_engine.report(virtual_canvas, document)
+    logger.info(f'Added {len(new_images)} images, re-rendered {len(changed)} of {report.page_count} pages')
+    logger.info(f'Layout: {report.summary()}')
+    return report
+
+
+def place_images_on_pdf(images: list[VirtualImage], output_pdf_path: str,
+                        margin: float, min_size: float,
+                        progress_callback: Callable[[int, Optional[str]], None] = default_progress_callback,
+                        render_options: Optional[RenderOptions] = None,
+                        streaming: bool = False,
+                        engine: str = ShelfEngine.name,
+                        incremental: bool = False,
+                        page_format: PageFormat = DEFAULT_FORMAT,
+                        search_budget: float = 0,
+                        max_open_pages: Optional[int] = None) -> LayoutReport:
+
+    document = VirtualDocument(margin, page_format.width, page_format.height)
+    virtual_canvas = VirtualCanvas(progress_callback, document.pagesize)
+    packing_engine = get_engine(engine, max_open_pages)
+
+    if incremental:
+        report = place_images_incrementally(images, output_pdf_path, document, min_size, progress_callback,
+                                            render_options, engine, max_open_pages)
+        if report is not None:
+            return report
+        if streaming:
+            logger.info('Saving the layout needs the whole layout, streaming is disabled')
+            streaming = False
+    if streaming and render_options is not None and render_options.shards > 1:
+        logger.info('Sharded rendering needs the whole layout, streaming is disabled')
+        streaming = False
+    arranged = images
+    if search_budget > 0:
+        from layout_search import search_layout
+
+        with instrumentation.span('search'):
+            arranged = search_layout(images, document, min_size, engine, search_budget, progress_callback,
+                                     render_options.workers if render_options else None,
+                                     max_open_pages=max_open_pages)
+    if streaming:
+        virtual_canvas.openReal(output_pdf_path, render_options)
+    layout = None
+    try:
+        with instrumentation.span('pack'):
+            packing_engine.pack(arranged, document, min_size, virtual_canvas, progress_callback, streaming)
+        if incremental:
+            layout = capture_layout(images, virtual_canvas, packing_engine,
+                                    layout_parameters(document, engine, render_options, max_open_pages), min_size)
+        virtual_canvas.makeItReal(output_pdf_path, render_options)
+    finally:
+        virtual_canvas.closeReal()
+    if layout is not None:
+        layout.pdf = file_stamp(output_pdf_path)
+        save_layout(layout_path(output_pdf_path), layout)
+    report = packing_engine.report(virtual_canvas, document)
+    logger.info(f'Layout: {report.summary()}')
+    return report
 
 
 if __name__ == "__main__":
-    config_default_logging()
-    logger.info('STARTING PDF MAKER')
-    directory = "/Users/betty/projects/2025-03-25/vetochka/images"
-    max_width_cm, max_height_cm = 10, 15.5
-    # output_pdf_path = "/Users/betty/PythonProjects/image_resize/output_images.pdf"
-    output_pdf_path = "/Users/betty/projects/2025-03-25/vetochka/images/output_imagess.pdf"
-    start_time = time()
-    images, min_size = collect_and_resize_images(directory, max_width_cm, max_height_cm)
-    place_images_on_pdf(images, output_pdf_path, cm_to_points(0.2), min_size)
-    #rotate_fun(output_pdf_path)
-    logger.info(f"PDF document '{output_pdf_path}' has been created with images.")
-    duration = time() - start_time
-    logger.debug(f'overall duration = {duration}')
+    import sys
+
+    import batch
+    sys.exit(batch.main())
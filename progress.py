@@ -0,0 +1,131 @@
+import math
+from collections.abc import Callable
+from dataclasses import dataclass
+from time import monotonic
+from typing import Optional
+
+PHASE_WEIGHTS = {
+    'scan': 0.3,
+    'search': 0.2,
+    'calculation': 0.1,
+    'placement': 0.3,
+}
+# A streamed PDF draws most pages while they are still being packed, so the calculation phase takes the time
+# and placement only writes the last open pages.
+STREAMING_PHASE_WEIGHTS = {
+    'scan': 0.3,
+    'search': 0.2,
+    'calculation': 0.35,
+    'placement': 0.05,
+}
+DEFAULT_INTERVAL = 0.5
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class ProgressStatus:
+    phase: Optional[str]
+    value: int
+    overall: int
+    elapsed: float
+    eta: Optional[float] = None
+    rate: Optional[float] = None
+
+
+# A progress callback for jobs nobody watches, such as batch runs and the packing done while searching.
+def silent_progress(value: int, label: Optional[str] = None):
+    pass
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes}:{seconds:02d}'
+
+
+# A (value, label) progress callback that forwards only changes to the wrapped callback. The status callback also
+# gets the overall percentage across phases, throughput and ETA on every change, and at most every `interval`
+# seconds while the value stands still.
+class ProgressReporter:
+    def __init__(self, callback: Optional[Callable[[int, Optional[str]], None]] = None,
+                 status_callback: Optional[Callable[[ProgressStatus], None]] = None,
+                 phases: tuple[str, ...] = tuple(PHASE_WEIGHTS), interval: float = DEFAULT_INTERVAL,
+                 clock: Callable[[], float] = monotonic,
+                 cancelled: Optional[Callable[[], bool]] = None,
+                 weights: Optional[dict[str, float]] = None):
+        self.callback = callback
+        self.cancelled = cancelled
+        self.status_callback = status_callback
+        if weights is None:
+            weights = PHASE_WEIGHTS
+        total_weight = sum(weights.get(phase, 0) for phase in phases) or 1
+        self.weights = {phase: weights.get(phase, 0) / total_weight for phase in phases}
+        self.interval = interval
+        self.clock = clock
+        self.items: dict[str, int] = {}
+        self.started = clock()
+        self.phase: Optional[str] = None
+        self.phase_started = self.started
+        # A phase can start part way, like placement after a streamed PDF drew most pages, so the rate only
+        # counts the progress made since the first value of the phase.
+        self.phase_start_value = 0
+        self.done_weight = 0.0
+        self.value = -1
+        self.last_emit = -math.inf
+
+    def expect(self, phase: str, items: int):
+        self.items[phase] = items
+
+    def __call__(self, value: int, label: Optional[str] = None):
+        # Every stage reports progress often, so this is where a cancelled job stops.
+        self.check_cancelled()
+        now = self.clock()
+        phase_changed = label is not None and label != self.phase
+        if phase_changed:
+            self.enter(label, now)
+        if not phase_changed and value == self.value and now - self.last_emit < self.interval:
+            return
+        changed = phase_changed or value != self.value
+        if phase_changed:
+            self.phase_start_value = value
+        self.value = value
+        self.last_emit = now
+        if changed and self.callback is not None:
+            self.callback(value, label if phase_changed else None)
+        if self.status_callback is not None:
+            self.status_callback(self.status(now))
+
+    # For long steps that have no progress of their own to report, such as hashing and writing pages.
+    def check_cancelled(self):
+        if self.cancelled is not None and self.cancelled():
+            raise JobCancelled()
+
+    def enter(self, phase: str, now: float):
+        # Every phase before this one counts as done, including the ones the job skipped.
+        if phase in self.weights:
+            order = list(self.weights)
+            self.done_weight = sum(self.weights[done] for done in order[:order.index(phase)])
+        self.phase = phase
+        self.phase_started = now
+        self.value = -1
+
+    def overall(self) -> float:
+        weight = self.weights.get(self.phase, 0)
+        return min(1.0, self.done_weight + weight * max(self.value, 0) / 100)
+
+    def status(self, now: Optional[float] = None) -> ProgressStatus:
+        if now is None:
+            now = self.clock()
+        elapsed = now - self.started
+        overall = self.overall()
+        eta = elapsed * (1 - overall) / overall if overall > 0 else None
+        rate = None
+        items = self.items.get(self.phase)
+        phase_elapsed = now - self.phase_started
+        progressed = self.value - self.phase_start_value
+        if items and phase_elapsed > 0 and progressed > 0:
+            rate = items * progressed / 100 / phase_elapsed
+        return ProgressStatus(self.phase, max(self.value, 0), math.floor(overall * 100), elapsed, eta, rate)
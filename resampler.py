@@ -0,0 +1,159 @@
+import logging
+import os
+from collections.abc import Callable, Iterable, Iterator
+import uuid
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from contextlib import nullcontext, suppress
+from dataclasses import dataclass
+from typing import Optional, TYPE_CHECKING, Union
+
+from scanner import TRANSPOSED_ORIENTATIONS
+
+if TYPE_CHECKING:
+    from variant_cache import VariantCache
+
+logger = logging.getLogger(__name__)
+
+POINTS_PER_INCH = 72
+# Pillow's Image.Transpose values that bring each EXIF orientation upright, as in ImageOps.exif_transpose.
+EXIF_TRANSPOSE = {2: 0, 3: 3, 4: 1, 5: 5, 6: 4, 7: 6, 8: 2}
+LOSSLESS_FORMAT = 'PNG'
+JPEG_FORMAT = 'JPEG'
+
+
+@dataclass(frozen=True)
+class RenderOptions:
+    dpi: Optional[int] = None
+    jpeg_quality: Optional[int] = 90
+    workers: Optional[int] = None
+    cache_budget: Optional[int] = None
+    shards: int = 1
+
+    @property
+    def resample(self) -> bool:
+        return bool(self.dpi)
+
+    @property
+    def format(self) -> str:
+        return JPEG_FORMAT if self.jpeg_quality else LOSSLESS_FORMAT
+
+    @property
+    def extension(self) -> str:
+        return '.jpg' if self.jpeg_quality else '.png'
+
+
+@dataclass(frozen=True)
+class ResampleJob:
+    path: str
+    width: int
+    height: int
+    rotated: bool = False
+    # The EXIF orientation the layout was measured with, the resampler does not read it again.
+    orientation: int = 1
+
+
+def points_to_pixels(points: float, dpi: int) -> int:
+    return max(1, round(points / POINTS_PER_INCH * dpi))
+
+
+def resample_job(path: str, width_points: float, height_points: float, rotated: bool, dpi: int,
+                 orientation: int = 1) -> ResampleJob:
+    return ResampleJob(path, points_to_pixels(width_points, dpi), points_to_pixels(height_points, dpi), rotated,
+                       orientation)
+
+
+def resample_image(job: ResampleJob, output_path: str, jpeg_quality: Optional[int]) -> Optional[str]:
+    from PIL import Image
+
+    size = (job.height, job.width) if job.rotated else (job.width, job.height)
+    with Image.open(job.path) as img:
+        # The job size is upright, the stored pixels may be turned by the EXIF orientation.
+        transpose = EXIF_TRANSPOSE.get(job.orientation)
+        stored_size = (size[1], size[0]) if job.orientation in TRANSPOSED_ORIENTATIONS else size
+        if img.width <= stored_size[0] and img.height <= stored_size[1]:
+            return None
+        img.draft(img.mode, stored_size)
+        resized = img.resize(stored_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    if transpose is not None:
+        resized = resized.transpose(transpose)
+    if job.rotated:
+        resized = resized.transpose(Image.Transpose.ROTATE_90)
+    if jpeg_quality:
+        if resized.mode not in ('RGB', 'L', 'CMYK'):
+            resized = resized.convert('RGB')
+        resized.save(output_path, JPEG_FORMAT, quality=jpeg_quality, optimize=True)
+    else:
+        resized.save(output_path, LOSSLESS_FORMAT)
+    return output_path
+
+
+def iter_resampled(jobs: Iterable[ResampleJob], output_dir: str, options: RenderOptions,
+                   cache: Optional['VariantCache'] = None, executor: Optional[Executor] = None,
+                   ahead: Optional[int] = None, done: Optional[dict[ResampleJob, Optional[str]]] = None,
+                   check_cancelled: Optional[Callable[[], None]] = None
+                   ) -> Iterator[tuple[ResampleJob, Optional[str]]]:
+    jobs = list(jobs)
+    if cache is not None:
+        cache.digest([job.path for job in jobs], options.workers, check_cancelled)
+    if ahead is None:
+        ahead = 2 * (options.workers or os.cpu_count() or 1)
+    # Variants from earlier calls are passed in `done` and reused, so a repeated image keeps its file.
+    started: dict[ResampleJob, Union[Future, Optional[str]]] = {} if done is None else done
+    keys = {}
+
+    def start(job: ResampleJob):
+        if job in started:
+            return
+        if cache is not None:
+            key = cache.key(job, options)
+            if key is None:
+                started[job] = None
+                return
+            cached, variant_path = cache.lookup(key)
+            if cached:
+                started[job] = variant_path
+                return
+            keys[job] = key
+            output_path = cache.staging_path(key, options)
+        else:
+            output_path = os.path.join(output_dir, f'{uuid.uuid4().hex}{options.extension}')
+        started[job] = executor.submit(resample_image, job, output_path, options.jpeg_quality)
+
+    def finish(job: ResampleJob) -> Optional[str]:
+        result = started[job]
+        if not isinstance(result, Future):
+            return result
+        try:
+            output_path = result.result()
+        except OSError as e:
+            logger.warning(f'Could not resample {job.path}, embedding the original: {e}')
+            started[job] = None
+            return None
+        # Recorded before storing, so a failing store does not leave a finished future for the cleanup below.
+        started[job] = output_path
+        if job in keys:
+            output_path = cache.store(keys.pop(job), output_path)
+            started[job] = output_path
+        return output_path
+
+    # Jobs are started at most `ahead` places before the one the caller waits for, in the caller's order.
+    with nullcontext(executor) if executor else ProcessPoolExecutor(max_workers=options.workers) as executor:
+        next_start = 0
+        try:
+            for index, job in enumerate(jobs):
+                while next_start < len(jobs) and next_start <= index + ahead:
+                    start(jobs[next_start])
+                    next_start += 1
+                yield job, finish(job)
+        finally:
+            pending = [(job, result) for job, result in started.items() if isinstance(result, Future)]
+            for job, result in pending:
+                del started[job]
+                if not result.cancel():
+                    try:
+                        output_path = result.result()
+                    except OSError:
+                        output_path = None
+                    if output_path is not None:
+                        with suppress(FileNotFoundError):
+                            os.remove(output_path)
@@ -0,0 +1,336 @@
+import hashlib
+import logging
+import math
+import os
+import struct
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, TypeVar
+
+import instrumentation
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.jpe', '.png', '.gif', '.bmp', '.tif', '.tiff', '.webp'})
+
+MAGIC_NUMBERS = (
+    b'\xff\xd8\xff',            # JPEG
+    b'\x89PNG\r\n\x1a\n',       # PNG
+    b'GIF87a', b'GIF89a',       # GIF
+    b'BM',                      # BMP
+    b'II*\x00', b'MM\x00*',     # TIFF
+)
+HASH_CHUNK_SIZE = 1024 * 1024
+# Most headers, and the EXIF block of most photos, are within the first read.
+PROBE_CHUNK_SIZE = 4096
+EXIF_ORIENTATION = 0x0112
+TIFF_IMAGE_WIDTH = 0x0100
+TIFF_IMAGE_LENGTH = 0x0101
+# EXIF orientations that store the picture turned by 90 degrees.
+TRANSPOSED_ORIENTATIONS = frozenset({5, 6, 7, 8})
+# Pillow turns the pixels of these formats upright as it opens them, so their orientation is already applied.
+UPRIGHT_FORMATS = frozenset({'TIFF'})
+# JPEG start of frame markers, the ones that carry the image size.
+JPEG_SOF_MARKERS = frozenset({0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF})
+JPEG_STANDALONE_MARKERS = frozenset({0x01, *range(0xD0, 0xD8)})
+JPEG_APP1 = 0xE1
+JPEG_SOS = 0xDA
+JPEG_EOI = 0xD9
+EXIF_HEADER = b'Exif\x00\x00'
+WEBP_EXIF_FLAG = 0x08
+
+
+@dataclass
+class JpegFrame:
+    marker: int
+    precision: int
+    width: int
+    height: int
+    components: int
+    orientation: int = 1
+
+
+@dataclass
+class ImageInfo:
+    path: str
+    width: int
+    height: int
+    format: str
+    orientation: int = 1
+
+    # The size as the picture is meant to be seen, after the EXIF orientation is applied.
+    @property
+    def upright_size(self) -> tuple[int, int]:
+        if self.orientation in TRANSPOSED_ORIENTATIONS:
+            return self.height, self.width
+        return self.width, self.height
+
+
+def has_image_extension(filename: str) -> bool:
+    return os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+
+
+def has_image_signature(header: bytes) -> bool:
+    if header.startswith(MAGIC_NUMBERS):
+        return True
+    return header[:4] == b'RIFF' and header[8:12] == b'WEBP'
+
+
+def probe_image(image_path: str) -> Optional[ImageInfo]:
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(image_path) as img:
+            orientation = 1 if img.format in UPRIGHT_FORMATS else img.getexif().get(EXIF_ORIENTATION, 1)
+            return ImageInfo(image_path, img.width, img.height, img.format, valid_orientation(orientation))
+    except UnidentifiedImageError:
+        logger.warning(f'The file {image_path} could not be identified as an image.')
+        return None
+
+
+def valid_orientation(orientation: int) -> int:
+    return orientation if 1 <= orientation <= 8 else 1
+
+
+def read_ifd_tags(read_at: Callable[[int, int], bytes], offset: int, little_endian: bool,
+                  wanted: frozenset[int]) -> dict[int, int]:
+    # Reads the SHORT and LONG values of the wanted tags from one TIFF image file directory.
+    order = '<' if little_endian else '>'
+    count_bytes = read_at(offset, 2)
+    if len(count_bytes) < 2:
+        return {}
+    count, = struct.unpack(order + 'H', count_bytes)
+    entries = read_at(offset + 2, 12 * count)
+    tags = {}
+    for start in range(0, len(entries) - 11, 12):
+        tag, value_type, value_count = struct.unpack(order + 'HHI', entries[start:start + 8])
+        if tag not in wanted or value_count != 1:
+            continue
+        if value_type == 3:
+            tags[tag], = struct.unpack(order + 'H', entries[start + 8:start + 10])
+        elif value_type == 4:
+            tags[tag], = struct.unpack(order + 'I', entries[start + 8:start + 12])
+    return tags
+
+
+def read_tiff_tags(read_at: Callable[[int, int], bytes], wanted: frozenset[int]) -> Optional[dict[int, int]]:
+    header = read_at(0, 8)
+    if len(header) < 8 or header[:4] not in (b'II*\x00', b'MM\x00*'):
+        return None
+    little_endian = header[:2] == b'II'
+    offset, = struct.unpack(('<' if little_endian else '>') + 'I', header[4:8])
+    return read_ifd_tags(read_at, offset, little_endian, wanted)
+
+
+def exif_orientation(exif: bytes) -> int:
+    tags = read_tiff_tags(lambda offset, size: exif[offset:offset + size], frozenset({EXIF_ORIENTATION}))
+    return valid_orientation(tags.get(EXIF_ORIENTATION, 1)) if tags else 1
+
+
+def parse_jpeg(f) -> Optional[JpegFrame]:
+    # Walks the marker segments up to the first start of frame, seeking over everything but the EXIF block.
+    orientation = 1
+    position = 2
+    while True:
+        f.seek(position)
+        prefix = f.read(2)
+        if len(prefix) < 2 or prefix[0] != 0xFF:
+            return None
+        marker = prefix[1]
+        position += 2
+        if marker == 0xFF:
+            position -= 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (JPEG_SOS, JPEG_EOI):
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length, = struct.unpack('>H', length_bytes)
+        if marker in JPEG_SOF_MARKERS:
+            frame = f.read(6)
+            if len(frame) < 6:
+                return None
+            precision, height, width, components = struct.unpack('>BHHB', frame)
+            return JpegFrame(marker, precision, width, height, components, orientation) if width and height else None
+        if marker == JPEG_APP1 and length > 8:
+            segment = f.read(length - 2)
+            if segment.startswith(EXIF_HEADER):
+                orientation = exif_orientation(segment[len(EXIF_HEADER):])
+        position += length
+
+
+def parse_webp(header: bytes) -> Optional[tuple[int, int]]:
+    chunk = header[12:16]
+    if chunk == b'VP8 ' and len(header) >= 30 and header[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(header) >= 25 and header[20] == 0x2F:
+        bits, = struct.unpack('<I', header[21:25])
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(header) >= 30:
+        # The orientation of an extended WebP is in an EXIF chunk at the end of the file, Pillow finds it.
+        if header[20] & WEBP_EXIF_FLAG:
+            return None
+        return (int.from_bytes(header[24:27], 'little') + 1, int.from_bytes(header[27:30], 'little') + 1)
+    return None
+
+
+def parse_header(path: str, f, header: bytes) -> Optional[ImageInfo]:
+    # Reads the size and orientation straight from the file header, None when Pillow has to do it.
+    try:
+        if header.startswith(b'\xff\xd8\xff'):
+            frame = parse_jpeg(f)
+            return ImageInfo(path, frame.width, frame.height, 'JPEG', frame.orientation) if frame else None
+        if header.startswith(b'\x89PNG\r\n\x1a\n') and header[12:16] == b'IHDR' and len(header) >= 24:
+            width, height = struct.unpack('>II', header[16:24])
+            return ImageInfo(path, width, height, 'PNG')
+        if header.startswith((b'GIF87a', b'GIF89a')) and len(header) >= 10:
+            width, height = struct.unpack('<HH', header[6:10])
+            return ImageInfo(path, width, height, 'GIF')
+        if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+            parsed = parse_webp(header)
+            return ImageInfo(path, parsed[0], parsed[1], 'WEBP') if parsed else None
+        if header.startswith((b'II*\x00', b'MM\x00*')):
+            def read_at(offset: int, size: int) -> bytes:
+                if offset + size <= len(header):
+                    return header[offset:offset + size]
+                f.seek(offset)
+                return f.read(size)
+
+            tags = read_tiff_tags(read_at, frozenset({TIFF_IMAGE_WIDTH, TIFF_IMAGE_LENGTH, EXIF_ORIENTATION}))
+            if not tags or TIFF_IMAGE_WIDTH not in tags or TIFF_IMAGE_LENGTH not in tags:
+                return None
+            width, height = tags[TIFF_IMAGE_WIDTH], tags[TIFF_IMAGE_LENGTH]
+            if tags.get(EXIF_ORIENTATION) in TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+            return ImageInfo(path, width, height, 'TIFF')
+    except struct.error:
+        return None
+    return None
+
+
+def checked_probe(path: str, probe: Optional[Callable[[str], Optional[T]]] = None) -> Optional[T]:
+    # Without a probe the header is parsed natively and Pillow only opens what the parser does not know.
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(PROBE_CHUNK_SIZE)
+            if not has_image_signature(header):
+                logger.warning(f'The file {path} does not look like an image.')
+                return None
+            if probe is None:
+                with instrumentation.span('probe'):
+                    info = parse_header(path, f, header)
+                if info is not None:
+                    instrumentation.count('native_probes')
+                    return info
+    except OSError as e:
+        logger.warning(f'The file {path} could not be read: {e}')
+        return None
+    with instrumentation.span('probe'):
+        return (probe or probe_image)(path)
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checked_digest(path: str) -> Optional[str]:
+    try:
+        return file_digest(path)
+    except OSError as e:
+        logger.warning(f'The file {path} could not be hashed: {e}')
+        return None
+
+
+def find_duplicates(infos: list[ImageInfo], max_workers: Optional[int] = None,
+                    digest: Callable[[str], Optional[str]] = checked_digest,
+                    progress_callback: Optional[Callable[[int, Optional[str]], None]] = None) -> dict[str, str]:
+    # Identical files agree on size and dimensions, so only files sharing both with another one are hashed.
+    # Every duplicate maps to the first path with the same content in scan order.
+    groups: dict[tuple[int, int, int], list[str]] = {}
+    for info in infos:
+        try:
+            size = os.path.getsize(info.path)
+        except OSError:
+            continue
+        groups.setdefault((size, info.width, info.height), []).append(info.path)
+    candidates = [path for paths in groups.values() if len(paths) > 1 for path in paths]
+    if not candidates:
+        return {}
+    digests = []
+    with (instrumentation.span('digest'),
+          ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='digest') as executor):
+        try:
+            for content_digest in executor.map(digest, candidates):
+                digests.append(content_digest)
+                # Hashing big files takes a while, so a cancelled job stops here too.
+                if progress_callback is not None:
+                    progress_callback(100)
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+    originals: dict[str, str] = {}
+    duplicates = {}
+    for path, content_digest in zip(candidates, digests):
+        if content_digest is None:
+            continue
+        original = originals.setdefault(content_digest, path)
+        if original != path:
+            duplicates[path] = original
+    instrumentation.count('duplicates', len(duplicates))
+    logger.info(f'Hashed {len(candidates)} look-alike images, {len(duplicates)} duplicates found')
+    return duplicates
+
+
+def iter_image_files(directory: str) -> Iterator[str]:
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        subdirs = []
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif entry.is_file() and has_image_extension(entry.name):
+                            yield entry.path
+                    except OSError as e:
+                        logger.warning(f'Skipping {entry.path}: {e}')
+        except OSError as e:
+            logger.warning(f'Could not scan directory {current}: {e}')
+        pending.extend(reversed(subdirs))
+
+
+def probe_images(paths: list[str], probe: Callable[[str], Optional[T]],
+                 progress_callback: Callable[[int, Optional[str]], None],
+                 max_workers: Optional[int] = None) -> list[T]:
+    results = []
+    total = len(paths)
+    scanned_progress = 0
+    progress_callback(scanned_progress, 'scan')
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scan') as executor:
+        try:
+            for done, result in enumerate(executor.map(probe, paths), start=1):
+                if result is not None:
+                    results.append(result)
+                else:
+                    instrumentation.count('files_skipped')
+                scanned_progress = math.floor((done / total)*100)
+                logger.debug('SCAN IS DONE for %d%%: %d of %d', scanned_progress, done, total)
+                progress_callback(scanned_progress)
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+    logger.info(f'Scanned {total} candidate files, {len(results)} images found')
+    return results
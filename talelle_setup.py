@@ -1,18 +1,39 @@
+import atexit
 import logging
 import logging.config
+import logging.handlers
 
 import os
+import queue
 import shutil
 from pathlib import Path
+from typing import Optional
 
 def to_path(path: str) -> Path:
     return Path(path)
 
 TALELLE_DIR = os.path.join(os.path.expanduser('~'), 'TalelleApps')
 to_path(TALELLE_DIR).mkdir(parents=True, exist_ok=True)
+TRACE_ENV = 'TALELLE_TRACE'
 
 
-def config_log(talelle_tool: str):
+def tracing_enabled() -> bool:
+    return os.environ.get(TRACE_ENV, '').lower() not in ('', '0', 'false', 'no')
+
+
+def log_in_background(logger: logging.Logger) -> logging.handlers.QueueListener:
+    handlers = logger.handlers[:]
+    for handler in handlers:
+        logger.removeHandler(handler)
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def config_log(talelle_tool: str, trace: Optional[bool] = None):
     log_conf_name = 'logging.conf'
     local_log_conf = f'./{log_conf_name}'
 
@@ -22,4 +43,15 @@ def config_log(talelle_tool: str):
     if not os.path.exists(log_conf):
         shutil.copy(local_log_conf, log_conf)
 
-    logging.config.fileConfig(log_conf, defaults={"log_path": log_file})
\ No newline at end of file
+    logging.config.fileConfig(log_conf, defaults={"log_path": log_file})
+
+    # Per-image debug lines are only written when tracing, otherwise each job logs its summary.
+    root = logging.getLogger()
+    if trace is None:
+        trace = tracing_enabled()
+    if trace:
+        root.setLevel(logging.DEBUG)
+    elif root.level < logging.INFO:
+        root.setLevel(logging.INFO)
+    # The file is written from a listener thread so the workers never wait on disk.
+    log_in_background(root)
\ No newline at end of file
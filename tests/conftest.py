@@ -0,0 +1,25 @@
+import os
+import random
+import sys
+
+import pytest
+from PIL import Image
+
+# The modules live at the top of the repository, which is not an installed package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_images(directory, count: int, seed: int = 0, prefix: str = 'image'):
+    rng = random.Random(seed)
+    directory.mkdir(exist_ok=True)
+    for number in range(count):
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        Image.new('RGB', (rng.randint(40, 400), rng.randint(40, 400)), color).save(
+            directory / f'{prefix}{number:03d}.png')
+
+
+@pytest.fixture
+def images_dir(tmp_path):
+    directory = tmp_path / 'images'
+    make_images(directory, 80)
+    return directory
@@ -0,0 +1,8 @@
+import pytest
+
+from benchmark import run_free_space_check
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_shelf_placements_match_sorted_list(seed):
+    assert run_free_space_check(1, 300, seed)['mismatched_seeds'] == []
@@ -0,0 +1,63 @@
+import logging
+
+import pypdf
+
+import placement
+from conftest import make_images
+from layout_store import layout_path, load_layout
+from progress import silent_progress
+
+
+def render(images_dir, pdf_path, progress_callback=silent_progress, **options):
+    images, min_size = placement.collect_and_resize_images(str(images_dir), 4, 6, silent_progress)
+    return placement.place_images_on_pdf(images, pdf_path, 10, min_size, progress_callback, incremental=True,
+                                         **options)
+
+
+def test_unchanged_images_keep_the_pdf(tmp_path, images_dir, caplog):
+    pdf_path = str(tmp_path / 'collage.pdf')
+    first = render(images_dir, pdf_path)
+    with open(pdf_path, 'rb') as f:
+        written = f.read()
+    progress = []
+    with caplog.at_level(logging.INFO, logger='placement'):
+        second = render(images_dir, pdf_path, lambda value, label=None: progress.append((value, label)))
+    assert 'Added 0 images, re-rendered 0 of' in caplog.text
+    with open(pdf_path, 'rb') as f:
+        assert f.read() == written
+    assert second.page_count == first.page_count
+    assert progress[-1] == (100, 'placement')
+
+
+def test_new_images_are_added_to_the_layout(tmp_path, images_dir, caplog):
+    pdf_path = str(tmp_path / 'collage.pdf')
+    render(images_dir, pdf_path)
+    before = load_layout(layout_path(pdf_path)).pages
+    make_images(images_dir, 5, seed=1, prefix='added')
+    with caplog.at_level(logging.INFO, logger='placement'):
+        report = render(images_dir, pdf_path)
+    assert 'Added 5 images' in caplog.text
+    after = load_layout(layout_path(pdf_path)).pages
+    # Images already placed keep their place, new ones only go into gaps or onto new pages.
+    for old_page, new_page in zip(before, after):
+        assert new_page[:len(old_page)] == old_page
+    assert report.image_count == 85
+    assert len(pypdf.PdfReader(pdf_path).pages) == report.page_count
+
+
+def test_changed_parameters_rebuild_the_layout(tmp_path, images_dir, caplog):
+    pdf_path = str(tmp_path / 'collage.pdf')
+    render(images_dir, pdf_path)
+    with caplog.at_level(logging.INFO, logger='placement'):
+        render(images_dir, pdf_path, engine=placement.MaxRectsEngine.name)
+    assert 'Rebuilding the whole layout: layout parameters changed' in caplog.text
+
+
+def test_removed_images_rebuild_the_layout(tmp_path, images_dir, caplog):
+    pdf_path = str(tmp_path / 'collage.pdf')
+    render(images_dir, pdf_path)
+    (images_dir / 'image000.png').unlink()
+    with caplog.at_level(logging.INFO, logger='placement'):
+        report = render(images_dir, pdf_path)
+    assert 'Rebuilding the whole layout: images were removed' in caplog.text
+    assert report.image_count == 79
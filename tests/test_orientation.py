@@ -0,0 +1,50 @@
+import pytest
+from PIL import Image, ImageOps
+
+import scanner
+from resampler import resample_image, resample_job
+
+# The Pillow transposes that turn an upright picture into the stored pixels of each EXIF orientation.
+STORED = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_90,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_270,
+}
+
+
+def save_oriented(path: str, orientation: int):
+    # An upright 400x200 picture with a red square in its top left corner.
+    upright = Image.new('RGB', (400, 200), (255, 255, 255))
+    upright.paste((255, 0, 0), (0, 0, 60, 60))
+    stored = upright.transpose(STORED[orientation]) if orientation in STORED else upright
+    data = Image.Exif()
+    data[scanner.EXIF_ORIENTATION] = orientation
+    stored.save(path, exif=data.tobytes(), quality=95)
+
+
+@pytest.mark.parametrize('orientation', range(1, 9))
+def test_probe_reads_orientation(tmp_path, orientation):
+    path = str(tmp_path / f'o{orientation}.jpg')
+    save_oriented(path, orientation)
+    info = scanner.checked_probe(path)
+    assert info.orientation == orientation
+    with Image.open(path) as img:
+        assert info.upright_size == ImageOps.exif_transpose(img).size == (400, 200)
+
+
+@pytest.mark.parametrize('orientation', range(1, 9))
+def test_resampled_variant_is_upright(tmp_path, orientation):
+    path = str(tmp_path / f'o{orientation}.jpg')
+    save_oriented(path, orientation)
+    info = scanner.checked_probe(path)
+    # At 72 DPI a point is a pixel, so this halves the upright picture.
+    job = resample_job(path, 200, 100, False, 72, info.orientation)
+    output_path = resample_image(job, str(tmp_path / 'variant.png'), None)
+    with Image.open(output_path) as variant:
+        assert variant.size == (200, 100)
+        red, green, _ = variant.convert('RGB').getpixel((5, 5))
+        assert red > 200 and green < 80
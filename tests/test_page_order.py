@@ -0,0 +1,47 @@
+import random
+import re
+
+import pytest
+import pypdf
+from PIL import Image
+
+import placement
+from image_table import ImageTable
+from progress import silent_progress
+from resampler import RenderOptions
+from scanner import ImageInfo
+
+MODES = {
+    'batch': {},
+    'streaming': {'streaming': True},
+    'sharded': {'render_options': RenderOptions(shards=3)},
+}
+CM = re.compile(rb'(-?[\d.]+) (-?[\d.]+) (-?[\d.]+) (-?[\d.]+) (-?[\d.]+) (-?[\d.]+) cm')
+
+
+def page_contents(pdf_path: str) -> list[bytes]:
+    return [page.get_contents().get_data() for page in pypdf.PdfReader(pdf_path).pages]
+
+
+# Mixed sizes leave gaps on early pages open while later pages fill up, which is when streaming could get ahead.
+def mixed_images(path: str, count: int, seed: int = 0) -> tuple[list[placement.VirtualImage], float]:
+    Image.new('RGB', (10, 10), (255, 0, 0)).save(path)
+    rng = random.Random(seed)
+    infos = [ImageInfo(path, rng.randint(50, 4000), rng.randint(50, 4000), 'PNG') for _ in range(count)]
+    return placement.fit_table(ImageTable(infos), *placement.max_box_points(6, 9))
+
+
+@pytest.mark.parametrize('max_open_pages', [None, 4])
+@pytest.mark.parametrize('engine', sorted(placement.ENGINES))
+def test_every_mode_writes_the_layout_order(tmp_path, engine, max_open_pages):
+    images, min_size = mixed_images(str(tmp_path / 'image.png'), 200)
+    written = {}
+    for mode, options in MODES.items():
+        pdf_path = str(tmp_path / f'{mode}.pdf')
+        report = placement.place_images_on_pdf(images, pdf_path, 10, min_size, silent_progress, engine=engine,
+                                               max_open_pages=max_open_pages, **options)
+        contents = page_contents(pdf_path)
+        assert report.page_count == len(contents) > 1
+        assert [page.images for page in report.pages] == [content.count(b' Do') for content in contents]
+        written[mode] = [CM.findall(content) for content in contents]
+    assert written['streaming'] == written['batch'] == written['sharded']
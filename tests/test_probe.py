@@ -0,0 +1,44 @@
+import pytest
+from PIL import Image
+
+import scanner
+
+ORIENTATION = 0x0112
+
+
+def exif(orientation: int) -> bytes:
+    data = Image.Exif()
+    data[ORIENTATION] = orientation
+    return data.tobytes()
+
+
+SAMPLES = {
+    'baseline.jpg': {},
+    'progressive.jpg': {'progressive': True},
+    'oriented.jpg': {'exif': exif(6)},
+    'image.png': {},
+    'image.gif': {},
+    'image.bmp': {},
+    'image.tif': {},
+    'oriented.tif': {'exif': exif(6)},
+    'lossy.webp': {},
+    'lossless.webp': {'lossless': True},
+    'oriented.webp': {'exif': exif(6)},
+}
+
+
+@pytest.mark.parametrize('name', sorted(SAMPLES))
+def test_native_probe_matches_pillow(tmp_path, name):
+    path = str(tmp_path / name)
+    Image.new('RGB', (37, 21), (200, 10, 10)).save(path, **SAMPLES[name])
+    native = scanner.checked_probe(path)
+    pillow = scanner.checked_probe(path, scanner.probe_image)
+    assert native is not None and pillow is not None
+    assert (native.width, native.height, native.format, native.orientation, native.upright_size) == \
+           (pillow.width, pillow.height, pillow.format, pillow.orientation, pillow.upright_size)
+
+
+def test_probe_skips_files_that_are_not_images(tmp_path):
+    path = tmp_path / 'fake.jpg'
+    path.write_bytes(b'not an image')
+    assert scanner.checked_probe(str(path)) is None
@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import os
+import sqlite3
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Optional
+
+import instrumentation
+from metadata_index import SQLITE_TIMEOUT
+from resampler import RenderOptions, ResampleJob
+from scanner import file_digest
+from talelle_setup import TALELLE_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(TALELLE_DIR, 'variant_cache')
+DEFAULT_CACHE_BUDGET = 2 * 1024 ** 3
+PARTIAL_SUFFIX = '.partial'
+SQL_BATCH_SIZE = 500
+
+
+class VariantCache:
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_BUDGET):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(cache_dir, 'variants.sqlite'), timeout=SQLITE_TIMEOUT)
+        # Shard workers and parallel batch jobs share the cache, so readers must not wait on a writer
+        # and every write is committed right away instead of holding the lock for a whole render.
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS variants ('
+            'key TEXT PRIMARY KEY, file TEXT, size INTEGER NOT NULL, last_used REAL NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS variants_last_used ON variants (last_used);'
+            'CREATE TABLE IF NOT EXISTS digests ('
+            'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL);'
+        )
+        self.digests: dict[str, str] = {}
+        self.used: list[str] = []
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def digest(self, paths: list[str], max_workers: Optional[int] = None,
+               check_cancelled: Optional[Callable[[], None]] = None):
+        missing = [path for path in dict.fromkeys(paths) if path not in self.digests]
+        if not missing:
+            return
+        stats = {}
+        for path in missing:
+            try:
+                stats[path] = os.stat(path)
+            except OSError as e:
+                logger.warning(f'Could not stat {path}, it will not be cached: {e}')
+        stat_paths = list(stats)
+        for start in range(0, len(stat_paths), SQL_BATCH_SIZE):
+            batch = stat_paths[start:start + SQL_BATCH_SIZE]
+            rows = self.connection.execute(
+                f'SELECT path, size, mtime_ns, digest FROM digests WHERE path IN ({",".join("?" * len(batch))})',
+                batch
+            )
+            for path, size, mtime_ns, digest in rows:
+                st = stats[path]
+                if st.st_size == size and st.st_mtime_ns == mtime_ns:
+                    self.digests[path] = digest
+        to_hash = [path for path in stats if path not in self.digests]
+        hashed = []
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='digest') as executor:
+            try:
+                for path, digest in zip(to_hash, executor.map(file_digest, to_hash)):
+                    hashed.append((path, digest))
+                    if check_cancelled is not None:
+                        check_cancelled()
+            except BaseException:
+                executor.shutdown(cancel_futures=True)
+                raise
+        self.digests.update(hashed)
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO digests (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)',
+                [(path, stats[path].st_size, stats[path].st_mtime_ns, digest) for path, digest in hashed]
+            )
+        logger.debug(f'Hashed {len(hashed)} source images, {len(stats) - len(hashed)} digests reused')
+
+    def key(self, job: ResampleJob, options: RenderOptions) -> Optional[str]:
+        digest = self.digests.get(job.path)
+        if digest is None:
+            return None
+        variant = (f'{digest}:{job.width}x{job.height}:{job.rotated}:o{job.orientation}:'
+                   f'{options.dpi}:{options.format}:{options.jpeg_quality}')
+        return hashlib.blake2b(variant.encode(), digest_size=20).hexdigest()
+
+    def variant_path(self, key: str, options: RenderOptions) -> str:
+        return os.path.join(self.cache_dir, key[:2], f'{key}{options.extension}')
+
+    def lookup(self, key: str) -> tuple[bool, Optional[str]]:
+        row = self.connection.execute('SELECT file FROM variants WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[0] is not None and not os.path.exists(row[0])):
+            self.misses += 1
+            instrumentation.count('cache_misses')
+            return False, None
+        self.hits += 1
+        instrumentation.count('cache_hits')
+        self.used.append(key)
+        return True, row[0]
+
+    def staging_path(self, key: str, options: RenderOptions) -> str:
+        variant_path = self.variant_path(key, options)
+        os.makedirs(os.path.dirname(variant_path), exist_ok=True)
+        return variant_path + PARTIAL_SUFFIX
+
+    def store(self, key: str, staged_path: Optional[str]) -> Optional[str]:
+        variant_path = None
+        size = 0
+        if staged_path is not None:
+            variant_path = staged_path.removesuffix(PARTIAL_SUFFIX)
+            os.replace(staged_path, variant_path)
+            size = os.path.getsize(variant_path)
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO variants (key, file, size, last_used) VALUES (?, ?, ?, ?)',
+                (key, variant_path, size, time())
+            )
+        return variant_path
+
+    def commit(self):
+        now = time()
+        with self.connection:
+            self.connection.executemany('UPDATE variants SET last_used = ? WHERE key = ?',
+                                        [(now, key) for key in self.used])
+            self.evict()
+        self.used = []
+        logger.info(f'Variant cache: {self.hits} hits, {self.misses} misses')
+
+    def evict(self):
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM variants').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, variant_path, size in self.connection.execute(
+                'SELECT key, file, size FROM variants ORDER BY last_used'):
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+            if variant_path is not None:
+                try:
+                    os.remove(variant_path)
+                except FileNotFoundError:
+                    pass
+        self.connection.executemany('DELETE FROM variants WHERE key = ?', evicted)
+        logger.info(f'Evicted {len(evicted)} least recently used variants, cache now holds {total} bytes')